@@ -9,19 +9,47 @@ Code to sort Wild Type, Red fluorescent, and Green fluorescent worms
 
 """
 
-import iotool
-from scope import scope_client
 from pathlib import Path
-import scipy
 import numpy
 import time
-import backgroundSubtraction
-import freeimage
 import threading
+import functools
+import collections
+import importlib
+from concurrent.futures import ThreadPoolExecutor
 import csv
+import json
+import os
+import sort_rules
 
 
 
+class _LazyModule:
+    """
+    Stands in for a module that is only imported when it is first used, so
+    that offline tools do not pay for (or need) the hardware and image libraries
+    """
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def load(self):
+        """
+        Imports the module if it is not imported yet and returns it
+        """
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attribute):
+        return getattr(self.load(), attribute)
+
+iotool = _LazyModule('iotool')
+scope_client = _LazyModule('scope.scope_client')
+ndimage = _LazyModule('scipy.ndimage')
+freeimage = _LazyModule('freeimage')
+
+
 #Setting useful constants
 #Areas for image analysis
 IMAGE_SIZE = (1280, 1080)
@@ -48,20 +76,55 @@ CLOG_THRESH = 10
 
 FLUORESCENCE_PERCENTILE = 99
 BACKGROUND_FRACTION = .99 #For Setting worm mask
+WORM_MASK_THRES = 5 #Multiple of the per pixel noise a worm pixel must differ from background
+WORM_MASK_PADDING = 5 #Pixels around the boiler area that are segmented
+DUST_SIZE = 50 #Objects smaller than this (in pixels) are not part of a worm
 
 CYAN_EXPOSURE_TIME = 4
 YELLOW_EXPOSURE_TIME = 8
 BRIGHT_FIELD_EXPOSURE_TIME = 2
 MAX_PUSH_TIME = .2
 
+#Bright field detection frames free run at the camera's frame rate ('Internal'
+#trigger), analysis and sorting frames are software triggered
+FREE_RUNNING_DETECTION = True
+#Seconds per second the camera to host clock offset may rise, to follow drift
+CLOCK_DRIFT = 1e-3
+
 LIGHT_DELAY = .05
 PICTURE_DELAY = .01
 SORTING_INTERVAL = .05
 MAX_SORTING_TIME = 1.5
 
+ANALYSIS_WORKERS = 2 #Quantification of both fluorescence channels
+SAVE_WORKERS = 2
+SAVE_QUEUE_LIMIT = 32 #Images waiting to be saved, about 90 MB of full frames
+
+CHECKPOINT_INTERVAL = 60 #Seconds between checkpoints of the sorter state
+CHECKPOINT_FILE = 'checkpoint.json'
+CHECKPOINT_IMAGES_FILE = 'checkpoint_backgrounds.npz'
+RULES_FILE = 'rules.json' #Rule set of the run, for scoring it offline with sort_rules
+
+#Polling of an empty queue is slowed down after IDLE_BACKOFF_TIME seconds,
+#the interval between polls grows by POLL_BACKOFF_FACTOR up to MAX_POLL_INTERVAL
+IDLE_BACKOFF_TIME = 30
+MIN_POLL_INTERVAL = .1
+MAX_POLL_INTERVAL = 2
+POLL_BACKOFF_FACTOR = 2
+
 BACKGROUND_REFRESH_RATE = 100000
 PROGRESS_RATE = 100
 
+#Columns of wormdata.csv, one row is written per worm. Detection Time is from
+#pushing the queue to seeing the worm, Positioning Time from seeing it to it
+#stopping, Analysis Time from stopping to sorting and Sort Time is clearing it.
+#The frame times are the camera timestamps (seconds) of the frames the worm was
+#seen and found positioned in.
+WORM_DATA_FIELDS = ['Worm Number', 'Worm Size', 'Worm Direction', 'Detection Time',
+                    'Positioning Time', 'Analysis Time', 'Sort Time',
+                    'fluorMcherry', 'fluorGFP', 'Timestamp', 'Outcome', 'Rule',
+                    'Detection Frame Time', 'Positioned Frame Time']
+
 #Setting useful commands for device control
 
 PUSH_CHANNEL_PRESSURE= 'sh D6'
@@ -77,27 +140,181 @@ DOWN_CHANNEL_PRESSURE = 'sh D5'
 RELIEF_CHANNEL_SUCK = 'sl D2'
 RELIEF_CHANNEL_PRESSURE = 'sh D2'
 
+def _padded(area, padding):
+    return tuple(slice(max(part.start - padding, 0), min(part.stop + padding, size))
+                 for part, size in zip(area, IMAGE_SIZE))
+
+#Worm masks are only computed around the boiler, where a worm can be
+SEGMENTATION_AREA = _padded(BOILER_AREA, WORM_MASK_PADDING)
+FULL_FRAME = (slice(0, IMAGE_SIZE[0]), slice(0, IMAGE_SIZE[1]))
+POSITION_PIXELS = ((POSITION_AREA[0].stop - POSITION_AREA[0].start)
+                   * (POSITION_AREA[1].stop - POSITION_AREA[1].start))
+
 #Setting file locations for saving images
 
 #File_location = '/mnt/iscopearray/Nonet_Tim/Test##_##_##'
 
 
+@functools.lru_cache(maxsize=None)
 def boiler():
     """
     Returns a boolean array of possible locations of a worm duing sorting
+    The array is built once and shared, so it is read only.
     """
     boiler = numpy.ones(IMAGE_SIZE, dtype=bool)
     boiler[BOILER_AREA] = False
+    boiler.flags.writeable = False
     return boiler
 
+WormMask = collections.namedtuple('WormMask', ['mask', 'size', 'bounding_box', 'area'])
+Frame = collections.namedtuple('Frame', ['image', 'timestamp', 'number'])
+WormMask.__doc__ = """
+Segmented worm: mask covers area of the image, bounding_box is given in
+image coordinates (None if no worm was found)
+"""
+
+def segment_worm(image, background, threshold, area=SEGMENTATION_AREA, shade=None):
+    """
+    Returns the WormMask of the worm in image. Pixels differing from the
+    background by more than threshold are taken as worm, pixels outside the
+    boiler (or where the full frame mask shade is True) are ignored, objects
+    smaller than DUST_SIZE are removed and holes are filled. Only area is
+    processed; passing FULL_FRAME gives the same mask as long as area contains
+    the boiler with a margin.
+    """
+    if shade is None:
+        shade = boiler()
+    image = image[area]
+    difference = abs_difference(image, background[area], out=_scratch(image.shape, 'difference'))
+    mask = difference > threshold
+    mask[shade[area]] = False
+    labels, count = ndimage.label(mask)
+    if count:
+        keep = numpy.bincount(labels.ravel()) >= DUST_SIZE
+        keep[0] = False
+        mask = ndimage.binary_fill_holes(keep[labels])
+    size = int(numpy.count_nonzero(mask))
+    bounding_box = None
+    if size:
+        rows = numpy.flatnonzero(mask.any(axis=1))
+        columns = numpy.flatnonzero(mask.any(axis=0))
+        bounding_box = (slice(area[0].start + rows[0], area[0].start + rows[-1] + 1),
+                        slice(area[1].start + columns[0], area[1].start + columns[-1] + 1))
+    return WormMask(mask, size, bounding_box, area)
+
+def _to_json(value):
+    """
+    Converts numpy values for json.dump
+    """
+    if isinstance(value, (numpy.generic, numpy.ndarray)):
+        return value.tolist()
+    raise TypeError('Cannot save ' + type(value).__name__ + ' in a checkpoint')
+
+_scratch_buffers = threading.local()
+
+def _scratch(shape, name):
+    """
+    Returns a uint16 buffer of shape that is reused by later calls with the
+    same shape and name from the same thread
+    """
+    buffers = _scratch_buffers.__dict__
+    key = (shape, name)
+    if key not in buffers:
+        buffers[key] = numpy.empty(shape, dtype='uint16')
+    return buffers[key]
+
+def abs_difference(image1, image2, out=None):
+    """
+    Returns the absolute difference of two uint16 images without widening
+    them: the larger minus the smaller value can never wrap around.
+    The difference is written to out when given, the smaller values always
+    go to a scratch buffer.
+    """
+    smaller = numpy.minimum(image1, image2, out=_scratch(image1.shape, 'smaller'))
+    difference = numpy.maximum(image1, image2, out=out)
+    difference -= smaller
+    return difference
+
+def difference_sum(image1, image2, area):
+    """
+    Returns the absolute difference of two images summed over area. The sum
+    is accumulated in uint32 when it cannot overflow, which is faster than
+    int64.
+    """
+    image1, image2 = image1[area], image2[area]
+    difference = abs_difference(image1, image2, out=_scratch(image1.shape, 'difference'))
+    accumulator = 'uint32' if difference.size < 2**16 else 'int64'
+    return int(numpy.sum(difference, dtype=accumulator))
+
+class PollScheduler:
+    """
+    Backs off the rate at which the queue is polled while it stays empty and
+    snaps back to full rate on the first worm. Keeps track of the time spent
+    polling versus waiting (the duty cycle).
+    Settings left as None are read from the module constants when the
+    scheduler is made, so changes to the constants take effect.
+    """
+    def __init__(self, idle_time=None, min_interval=None, max_interval=None, factor=None):
+        self.idle_time = IDLE_BACKOFF_TIME if idle_time is None else idle_time
+        self.min_interval = MIN_POLL_INTERVAL if min_interval is None else min_interval
+        self.max_interval = MAX_POLL_INTERVAL if max_interval is None else max_interval
+        self.factor = POLL_BACKOFF_FACTOR if factor is None else factor
+        self.start = self.last_hit = time.time()
+        self.interval = 0
+        self.waited = 0
+
+    @property
+    def backing_off(self):
+        return self.interval > 0
+
+    def hit(self):
+        """
+        A worm was seen in the queue, poll at full rate again
+        """
+        self.last_hit = time.time()
+        self.interval = 0
+
+    def miss(self):
+        """
+        The queue was empty, starts or grows the backoff once it has been
+        empty for idle_time
+        """
+        if self.backing_off:
+            self.interval = min(self.interval * self.factor, self.max_interval)
+        elif time.time() - self.last_hit > self.idle_time:
+            self.interval = self.min_interval
+
+    def wait(self):
+        time.sleep(self.interval)
+        self.waited += self.interval
+
+    def duty_cycle(self):
+        """
+        Returns the fraction of time spent polling rather than waiting
+        """
+        elapsed = time.time() - self.start
+        return 1 - self.waited / elapsed if elapsed > 0 else 1
+
 class MicroDevice(threading.Thread):
     """
     Class for running a Microfluidic Device 
     """ 
     
-    def __init__(self, exp_direct):
+    #Whether resume() can rebuild the sorter from its checkpoint
+    resumable = True
+    #Attributes saved by save_checkpoint, extended by subclasses. Per worm
+    #histories are not checkpointed, restore_records rebuilds them from
+    #wormdata.csv.
+    checkpoint_attributes = ('worm_count', 'up', 'down', 'straight',
+                             'detect_background', 'positioned_background',
+                             'clear_background', 'dropped_frames', 'stale_frames',
+                             'failed_saves')
+    checkpoint_images = ('background',)
+
+    def __init__(self, exp_direct, resumed=False):
         """
         Initalizes the scope and device 
+        When resumed the summary of the experiment is appended to.
         """
         self.scope, scope_properties = scope_client.client_main()
         self.scope.camera.exposure_time = BRIGHT_FIELD_EXPOSURE_TIME
@@ -107,14 +324,51 @@ class MicroDevice(threading.Thread):
         self.scope.tl.lamp.enabled = True
         
         self.device = iotool.IOTool("/dev/ttyMicrofluidics")
+
+        #Imported now so a missing library fails here and not with a worm held
+        ndimage.load()
+        freeimage.load()
         
         self.file_location = Path(exp_direct)
         self.file_location.mkdir(mode=0o777, parents=True, exist_ok=True)
         self.summary_location = self.file_location.joinpath('summary.txt')
-        self.summary_statistics = open(str(self.summary_location),'w')
+        self.summary_statistics = open(str(self.summary_location), 'a' if resumed else 'w')
         self.data_location = self.file_location.joinpath('wormdata.csv')
+        new_data = not (resumed and self.data_location.exists())
+        fields = WORM_DATA_FIELDS
+        if not new_data:
+            #Keep the columns of the run being resumed
+            with open(str(self.data_location), newline='') as wormdata:
+                fields = next(csv.reader(wormdata, dialect='excel'), WORM_DATA_FIELDS)
+        self.worm_data = open(str(self.data_location), 'w' if new_data else 'a', newline='')
+        self.worm_writer = csv.DictWriter(self.worm_data, fields, dialect='excel',
+                                          extrasaction='ignore')
+        if new_data:
+            self.worm_writer.writeheader()
+        self.worm_record = dict()
+        self.time_last_worm = None
+        self.resumed = resumed
+        self.last_checkpoint = time.time()
         
         self.device_stop_load()
+
+        #Workers for image analysis that can overlap with imaging. Saves have
+        #their own bounded workers so a slow disk never holds up analysis.
+        self.workers = ThreadPoolExecutor(max_workers=ANALYSIS_WORKERS)
+        self.save_workers = ThreadPoolExecutor(max_workers=SAVE_WORKERS)
+        self.save_slots = threading.BoundedSemaphore(SAVE_QUEUE_LIMIT)
+        #A single worker keeps checkpoints in order
+        self.checkpointer = ThreadPoolExecutor(max_workers=1)
+        self.save_lock = threading.Lock()
+        self.failed_saves = 0
+
+        #Camera acquisition state
+        self.free_running = FREE_RUNNING_DETECTION
+        self.trigger_mode = None
+        self.last_frame_number = None
+        self.clock_offset = None
+        self.dropped_frames = 0
+        self.stale_frames = 0
         
         self.worm_count = 0
         self.up = 0
@@ -131,13 +385,115 @@ class MicroDevice(threading.Thread):
     def write_csv_file(self, worm_data):
          with open(str(self.data_location), 'w', newline = '') as wormdata:
              wormwriter = csv.writer(wormdata, dialect = 'excel')
-             wormwriter.writerow(['Worm Number', 'Worm Size', 'Worm Direction',
-                                  'Detection Time', 'Analysis Time', 'Sort Time',
-                                  'fluorMcherry', 'fluorGFP'])
+             wormwriter.writerow(WORM_DATA_FIELDS)
              for worms in worm_data: 
                  wormwriter.writerow(worms)
 
+    def start_worm_record(self):
+        """
+        Starts the record of a worm that is being pushed out of the queue
+        """
+        self.worm_record = {'Timestamp': self.time_queue_push_start, 'Outcome': 'sorted'}
+        self.worm_direction = None
+        self.time_seen = None
+        self.time_positioned = None
+        self.time_sort_start = None
+
+    def write_worm_record(self):
+        """
+        Completes the record of the current worm with its timings and appends
+        it to wormdata.csv. Analysis methods add their measurements to
+        self.worm_record.
+        """
+        record = self.worm_record
+        record['Worm Number'] = self.worm_count
+        record['Worm Direction'] = self.worm_direction
+        if self.time_seen is not None:
+            record['Detection Time'] = self.time_seen - self.time_queue_push_start
+        if self.time_seen is not None and self.time_positioned is not None:
+            record['Positioning Time'] = self.time_positioned - self.time_seen
+            self.time_to_position_worms.append(record['Positioning Time'])
+        if self.time_positioned is not None and self.time_sort_start is not None:
+            record['Analysis Time'] = self.time_sort_start - self.time_positioned
+        if self.time_sort_start is not None:
+            record['Sort Time'] = self.time_sort_end - self.time_sort_start
+        if self.time_last_worm is not None:
+            self.time_between_worms.append(record['Timestamp'] - self.time_last_worm)
+        self.time_last_worm = record['Timestamp']
+        self.worm_writer.writerow(record)
+        self.worm_data.flush()
+        self.worm_count += 1
+
         
+    def checkpoint_state(self):
+        """
+        Returns a json serializable dict of the sorter state
+        """
+        state = {'class': type(self).__name__}
+        for attribute in self.checkpoint_attributes:
+            if hasattr(self, attribute):
+                state[attribute] = getattr(self, attribute)
+        return state
+
+    def restore_state(self, state):
+        for attribute in self.checkpoint_attributes:
+            if attribute in state:
+                setattr(self, attribute, state[attribute])
+
+    def restore_records(self, records):
+        """
+        Rebuilds the worm count, direction counters and worm timings from the
+        rows of wormdata.csv. Worms are written there one at a time, so it is
+        ahead of the last checkpoint after a crash.
+        """
+        if records:
+            self.worm_count = int(records[-1]['Worm Number']) + 1
+            for direction in ('up', 'down', 'straight'):
+                setattr(self, direction, sum(1 for record in records
+                                             if record['Outcome'] == 'sorted'
+                                             and record['Worm Direction'] == direction))
+        timestamps = [float(record['Timestamp']) for record in records if record['Timestamp']]
+        self.time_between_worms = [later - earlier for earlier, later
+                                   in zip(timestamps, timestamps[1:])]
+        self.time_to_position_worms = [float(record['Positioning Time']) for record in records
+                                       if record.get('Positioning Time')]
+        self.time_last_worm = timestamps[-1] if timestamps else None
+
+    def save_checkpoint(self, images=False):
+        """
+        Writes the sorter state to the experiment directory. Background frames
+        are only written when images is True since they change rarely.
+        The state is taken here and written by the checkpoint worker, files
+        are replaced atomically so a crash never leaves a partial checkpoint.
+        """
+        self.summary_statistics.flush()
+        state = self.checkpoint_state()
+        backgrounds = None
+        if images:
+            backgrounds = {name: getattr(self, name)
+                           for name in self.checkpoint_images if hasattr(self, name)}
+        future = self.checkpointer.submit(self.write_checkpoint, state, backgrounds)
+        future.add_done_callback(self.check_checkpoint)
+        self.last_checkpoint = time.time()
+
+    def write_checkpoint(self, state, backgrounds=None):
+        if backgrounds is not None:
+            image_location = self.file_location.joinpath(CHECKPOINT_IMAGES_FILE)
+            temporary = str(image_location) + '.tmp'
+            with open(temporary, 'wb') as image_file:
+                numpy.savez(image_file, **backgrounds)
+            os.replace(temporary, str(image_location))
+        state_location = self.file_location.joinpath(CHECKPOINT_FILE)
+        temporary = str(state_location) + '.tmp'
+        with open(temporary, 'w') as state_file:
+            json.dump(state, state_file, default=_to_json)
+        os.replace(temporary, str(state_location))
+
+    def check_checkpoint(self, future):
+        error = future.exception()
+        if error is not None:
+            print('Could not write checkpoint: ' + repr(error))
+
     def set_scope(self):
         self.scope.camera.exposure_time = BRIGHT_FIELD_EXPOSURE_TIME
         self.scope.camera.readout_rate = '280 MHz'
@@ -167,6 +523,7 @@ class MicroDevice(threading.Thread):
         Device is set to a safe steady state
         """
         self.scope.camera.end_image_sequence_acquisition()
+        self.trigger_mode = None
         self.device.execute(PUSH_CHANNEL_PRESSURE, SEWER_CHANNEL_PRESSURE,
                             UP_CHANNEL_PRESSURE, STRAIGHT_CHANNEL_PRESSURE,
                             DOWN_CHANNEL_PRESSURE,RELIEF_CHANNEL_PRESSURE)
@@ -185,6 +542,7 @@ class MicroDevice(threading.Thread):
         print('pushing queue')
         self.time_queue_push_start = time.time()
         self.device.execute(RELIEF_CHANNEL_PRESSURE)
+        self.start_worm_record()
         
     def device_position_worm(self):
         print(' ')
@@ -208,6 +566,7 @@ class MicroDevice(threading.Thread):
         
         """
         print('Sorting worm '+ direction)
+        self.time_sort_start = time.time()
         if direction == 'up':
             self.device.execute(SEWER_CHANNEL_PRESSURE,
                                 UP_CHANNEL_SUCK,
@@ -226,8 +585,20 @@ class MicroDevice(threading.Thread):
                 break
             self.flutter_direction(direction)
             cleared_image = self.capture_image(self.bright)
+        self.time_sort_end = time.time()
         time.sleep(SORTING_INTERVAL)
 
+    def sort_worm(self, direction):
+        """
+        Sorts the positioned worm in the given direction and records it in the
+        direction counters and summary
+        """
+        self.device_sort(direction)
+        self.worm_direction = direction
+        setattr(self, direction, getattr(self, direction) + 1)
+        self.summary_statistics.write(direction.capitalize() + "\n")
+        print('Worm sorted ' + direction.capitalize() + '    ' + str(getattr(self, direction)))
+
     def flutter_direction(self, direction):
         print('fluttering')
         if direction == 'up':
@@ -310,19 +681,121 @@ class MicroDevice(threading.Thread):
         self.scope.camera.exposure_time = YELLOW_EXPOSURE_TIME
         time.sleep(PICTURE_DELAY)
   
+    def set_trigger_mode(self, trigger_mode):
+        """
+        Restarts the camera sequence acquisition in trigger_mode if it is not
+        already running in it. 'Internal' free runs at the camera's frame rate,
+        'Software' takes one frame per send_software_trigger.
+        """
+        if self.trigger_mode == trigger_mode:
+            return
+        if self.trigger_mode is not None:
+            self.scope.camera.end_image_sequence_acquisition()
+        self.timestamp_hz = self.scope.camera.timestamp_hz
+        self.scope.camera.start_image_sequence_acquisition(
+            frame_count=None, trigger_mode=trigger_mode)
+        self.trigger_mode = trigger_mode
+        self.last_frame_number = None
+        self.clock_offset = None
+
+    def next_frame(self):
+        """
+        Returns the next Frame of the acquisition: the uint16 image, its
+        camera timestamp in seconds and its frame number. Gaps in the frame
+        numbers are counted as dropped frames.
+        The camera clock is mapped to time.time() by self.clock_offset, the
+        offset of the quickest frame to arrive. It may rise by CLOCK_DRIFT so
+        that it follows the drift between the clocks.
+        """
+        image, timestamp, frame_number = self.scope.camera.next_image_and_metadata()
+        received = time.time()
+        if self.last_frame_number is not None and frame_number > self.last_frame_number + 1:
+            dropped = frame_number - self.last_frame_number - 1
+            self.dropped_frames += dropped
+            print('Dropped ' + str(dropped) + ' frames')
+        self.last_frame_number = frame_number
+        timestamp = timestamp / self.timestamp_hz
+        offset = received - timestamp
+        if self.clock_offset is not None:
+            offset = min(offset, self.clock_offset
+                         + CLOCK_DRIFT * (received - self.offset_checked))
+        self.clock_offset = offset
+        self.offset_checked = received
+        return Frame(image.astype('uint16', copy=False), timestamp, frame_number)
+
+    def next_fresh_frame(self, requested):
+        """
+        Returns the first free running frame taken after the time requested.
+        Frames that queued up in the camera before it (while the device was
+        commanded, during sleeps or analysis) are stale and skipped, to within
+        the readout time of a frame.
+        """
+        frame = self.next_frame()
+        while frame.timestamp + self.clock_offset < requested:
+            self.stale_frames += 1
+            frame = self.next_frame()
+        return frame
+
     def capture_image(self, type_of_image):
         """
-        Returns an int 32 image of with the features passed by the set up 
-        function type_of_image
+        Returns a uint16 image of with the features passed by the set up 
+        function type_of_image. Images are kept as uint16, use abs_difference
+        to subtract them.
         """
+        return self.capture_frame(type_of_image).image
+
+    def capture_frame(self, type_of_image):
+        """
+        Returns the Frame of a capture_image, with the camera timestamp and
+        frame number of the image.
+        Bright field frames come from the free running acquisition when
+        self.free_running is set, which is only while detecting and
+        positioning a worm; the illumination stays on bright field for as
+        long as the camera free runs, since any other image switches the
+        camera back to software triggering. Like a software triggered frame,
+        a free running frame is always taken after the call.
+        """
+        requested = time.time()
+        if self.free_running and type_of_image == self.bright:
+            if self.trigger_mode != 'Internal':
+                type_of_image()
+                self.set_trigger_mode('Internal')
+            return self.next_fresh_frame(requested)
+        self.set_trigger_mode('Software')
         type_of_image()
         self.scope.camera.send_software_trigger()
-        return self.scope.camera.next_image().astype('int32')
+        return self.next_frame()
         
     def save_image(self, image, name):
         save_location = str(self.file_location) + '/' + name + '.png'
-        freeimage.write(image.astype('uint16'), save_location,
+        freeimage.write(image.astype('uint16', copy=False), save_location,
                         flags=freeimage.IO_FLAGS.PNG_Z_BEST_SPEED)
+
+    def save_image_async(self, image, name):
+        """
+        Saves the image on a save worker so that imaging can carry on.
+        The image must not be modified afterwards. When SAVE_QUEUE_LIMIT
+        images are already waiting the image is not saved rather than waited
+        for. Failed and skipped saves are printed and counted in
+        self.failed_saves.
+        """
+        if not self.save_slots.acquire(blocking=False):
+            self.count_failed_save(name, 'too many images waiting to be saved')
+            return None
+        future = self.save_workers.submit(self.save_image, image, name)
+        future.add_done_callback(lambda future: self.check_saved(future, name))
+        return future
+
+    def check_saved(self, future, name):
+        self.save_slots.release()
+        error = future.exception()
+        if error is not None:
+            self.count_failed_save(name, repr(error))
+
+    def count_failed_save(self, name, reason):
+        with self.save_lock:
+            self.failed_saves += 1
+        print('Could not save ' + name + ': ' + reason)
                         
     def set_background_areas(self):
         """
@@ -335,6 +808,7 @@ class MicroDevice(threading.Thread):
         print('Worm has been lost')
         self.device_sort('straight lost')
         self.worm_direction = 'straight'
+        self.worm_record['Outcome'] = 'lost'
         self.summary_statistics.write("\nWorm " + str(self.worm_count) + "was lost")
         
     def check_position(self, current_image, detected_image):
@@ -343,9 +817,8 @@ class MicroDevice(threading.Thread):
         The worm is positioned because the change is small.
         """
         print('checking position')
-        worm_movment = abs(current_image[POSITION_AREA]
-         - detected_image[POSITION_AREA])
-        return  ((numpy.sum(worm_movment) - self.positioned_background) 
+        worm_movment = difference_sum(current_image, detected_image, POSITION_AREA)
+        return  ((worm_movment - self.positioned_background) 
             < POSITION_THRES * self.positioned_background)
 
     def check_queue(self, current_image):
@@ -355,8 +828,7 @@ class MicroDevice(threading.Thread):
         print('Required Value = ' + str(QUEUE_THREH  * self.detect_background))
         """
         #print('Checking Queue')
-        return ((numpy.sum(numpy.abs(current_image[QUEUE_AREA].astype('int32')
-                                     - self.background[QUEUE_AREA].astype('int32'))))
+        return (difference_sum(current_image, self.background, QUEUE_AREA)
                 > QUEUE_THREH  * self.detect_background)
 
     def check_lost(self, current_image):
@@ -365,16 +837,14 @@ class MicroDevice(threading.Thread):
         Worm is deciced lost because image is close enough to background.
         """
         print('Checking lost')
-        worm_visibility = abs(current_image[BOILER_AREA]
-                              - self.background[BOILER_AREA])
-        return ((numpy.sum(worm_visibility) - self.positioned_background) 
+        worm_visibility = difference_sum(current_image, self.background, BOILER_AREA)
+        return ((worm_visibility - self.positioned_background) 
             < LOST_CUTOFF * self.positioned_background) 
 
     def check_cleared(self, current_image):
         print('Checking Clear')
-        worm_visibility = abs(current_image[CLEARING_AREA]
-                              - self.background[CLEARING_AREA])
-        return ((numpy.sum(worm_visibility) - self.positioned_background) 
+        worm_visibility = difference_sum(current_image, self.background, CLEARING_AREA)
+        return ((worm_visibility - self.positioned_background) 
             < LOST_CUTOFF * self.positioned_background) 
     
     def check_worm(self, current_image):
@@ -389,21 +859,33 @@ class MicroDevice(threading.Thread):
         #print('Required Value:' + str( PUSH_THRESH * self.detect_background))
         if time.time() - self.time_queue_push_start > MAX_PUSH_TIME:
             return True
-        return ((numpy.sum(numpy.abs(current_image[POSITION_AREA] 
-                                     - self.background[POSITION_AREA]))-self.detect_background) 
+        return ((difference_sum(current_image, self.background, POSITION_AREA)
+                 - self.detect_background) 
         > PUSH_THRESH  * self.detect_background)
     
-    def worm_mask(self, worm_iamge):
+    def worm_threshold(self):
+        """
+        Returns the difference from background above which a pixel is part of
+        a worm, scaled from the frame to frame noise of the positioning area
+        """
+        return WORM_MASK_THRES * self.positioned_background / POSITION_PIXELS
+
+    def find_worm(self, worm_image):
+        """
+        Returns the WormMask (mask, size and bounding box) of the worm in
+        worm_image, segmented around the boiler only
         """
-        Function that saves an image of the mask of a worm and returns the size of mask (in number of pixels)
-        Depending on how background.backgroundSubtraction.clean_dust_and_holes(image) works this function might neeed to be modified so that it returns the appropriate image.
-        Currently the clean_dust_and_holes does not return the clean image and actually modifies the passed image.
+        return segment_worm(worm_image, self.background, self.worm_threshold())
+
+    def worm_mask(self, worm_image):
         """
-        subtracted_image = worm_image - self.bacgrkound
-        floored_image = backgroundSubtraction.percentile_floor(subtracted_image, .99)
-        floored_image[self.shade_area] = 0
-        backgroundSubtraction.clean_dust_and_holes(floored_image)
-        return floored_image.astype('bool')
+        Function that returns a full frame boolean mask of the worm
+        Use find_worm when the mask of the boiler area is enough.
+        """
+        worm = self.find_worm(worm_image)
+        mask = numpy.zeros(IMAGE_SIZE, dtype=bool)
+        mask[worm.area] = worm.mask
+        return mask
         
     def mask_size(self, worm_mask):
         return numpy.count_nonzero(worm_mask)
@@ -415,17 +897,54 @@ class MicroDevice(threading.Thread):
         """
         raise NotImplementedError('No sorting method given')
 
+    def idle_wait(self):
+        """
+        Waits out a backed off poll interval with the lamp off. Polls are
+        software triggered while backing off so no frames pile up meanwhile.
+        """
+        self.free_running = False
+        self.scope.tl.lamp.enabled = False
+        self.poll_scheduler.wait()
+
+    def end_idle(self):
+        """
+        Returns to free running detection after a worm was seen. The lamp is
+        turned back on and the acquisition restarted before the worm is
+        pushed, so the push is followed at the full frame rate.
+        """
+        self.start_detection()
+
+    def start_detection(self):
+        """
+        Restarts the free running bright field acquisition for detecting the
+        next worm.
+        """
+        self.free_running = FREE_RUNNING_DETECTION
+        self.bright()
+        if self.free_running:
+            self.set_trigger_mode('Internal')
+
+    def end_detection(self):
+        """
+        Keeps the camera software triggered until detection resumes, so
+        bright field frames taken between fluorescence images during analysis
+        and sorting do not restart the acquisition.
+        """
+        self.free_running = False
+
     def device_clear_and_reset(self):
         self.device_sort('straight')
+        self.worm_direction = 'straight'
+        self.worm_record['Outcome'] = 'cleared'
         self.background = self.capture_image(self.bright)
         self.save_image(self.background, 'background' + str(self.worm_count))
         self.set_background_areas()
+        self.save_checkpoint(images=True)
         self.cleared = False
         print('Reset background')
 
     def check_size_worm(self, current_image):
-        worm_mask = self.worm_mask(current_image)
-        worm_size = self.mask_size(worm_mask)
+        worm_size = self.find_worm(current_image).size
         print('Size of worm before sorting: ' + str(worm_size))
         if worm_size > self.size_threshold or worm_size < self.min_size_threshold:
             print('Detected Bad Worm')
@@ -439,14 +958,22 @@ class MicroDevice(threading.Thread):
         self.background = self.capture_image(self.bright)
         self.save_image(self.background, 'background' + str(self.worm_count))
         self.set_background_areas()
+        self.save_checkpoint(images=True)
         self.device_start_load()
       
     def initialize_sorting(self):
         """
         This function is run at the start of sorting 
+        A resumed sorter keeps the backgrounds and state of its checkpoint.
         """
-        self.set_background_areas()
         self.boiler = boiler()
+        if self.resumed:
+            print('Backgrounds restored from checkpoint.')
+            self.device_start_load()
+            self.time_start = time.time()
+            return
+
+        self.set_background_areas()
         print('Backgrounds have been set.')
 
         
@@ -461,6 +988,7 @@ class MicroDevice(threading.Thread):
 
         self.background = self.capture_image(self.bright)
         self.save_image(self.background, 'background')   
+        self.save_checkpoint(images=True)
                                     
     def run(self):
         """
@@ -476,8 +1004,8 @@ class MicroDevice(threading.Thread):
         #8 move worms
         #9 --> 1
         """
-        self.scope.camera.start_image_sequence_acquisition(
-            frame_count=None, trigger_mode='Software')
+        self.set_trigger_mode('Software')
+        self.poll_scheduler = PollScheduler()
         cycle_count = 0
         self.initialize_sorting()
         #0 Setting Background
@@ -493,37 +1021,59 @@ class MicroDevice(threading.Thread):
                 cycle_count += 1
                 current_image = self.capture_image(self.bright)
                 if self.check_queue(current_image):
+                    if self.poll_scheduler.backing_off:
+                        print('Worm in queue, polling at full rate')
+                        self.end_idle()
+                    self.poll_scheduler.hit()
                     self.device_push_queue()
                     while not self.quitting:
-                        current_image = self.capture_image(self.bright)
+                        frame = self.capture_frame(self.bright)
+                        current_image = frame.image
                         if self.check_pushed_forwards(current_image):
                             #3 stop worms
                             self.device_position_worm()
+                            self.worm_record['Detection Frame Time'] = frame.timestamp
                             while not self.quitting:
                                 detected_image = current_image
-                                current_image = self.capture_image(self.bright)
+                                frame = self.capture_frame(self.bright)
+                                current_image = frame.image
                                 if self.check_lost(current_image):
+                                    self.end_detection()
                                     self.device_clear_lost_worm()
                                     break
                                 elif self.check_position(current_image, detected_image):
+                                    self.time_positioned = time.time()
+                                    self.worm_record['Positioned Frame Time'] = frame.timestamp
+                                    self.end_detection()
                                     self.check_worm(current_image)
                                     self.analyze_worm(current_image)
                                     break
                                 if self.cleared:
+                                    self.end_detection()
                                     self.device_clear_and_reset()
                                     break
                                 else:
                                     detected_image = current_image
                             print('Breaking out of second loop')
+                            self.write_worm_record()
                             self.device_start_load()
+                            self.start_detection()
                             break
+                else:
+                    self.poll_scheduler.miss()
+                    if self.poll_scheduler.backing_off:
+                        self.idle_wait()
                     
                     
                 if cycle_count % PROGRESS_RATE == 0:
-                    print(str(PROGRESS_RATE) + ' Cycles')
+                    print(str(PROGRESS_RATE) + ' Cycles, polling duty cycle ' 
+                          + format(self.poll_scheduler.duty_cycle(), '.0%'))
                     
                 elif cycle_count % BACKGROUND_REFRESH_RATE == 0:
                     print(str(cycle_count) + ' Cycles Reseting Background')
+
+                if time.time() - self.last_checkpoint > CHECKPOINT_INTERVAL:
+                    self.save_checkpoint()
                     
         except KeyboardInterrupt:
             pass
@@ -531,10 +1081,24 @@ class MicroDevice(threading.Thread):
             self.summary_statistics.write('\n Average worm detection time :' 
                                           + str(numpy.mean(self.time_between_worms)) 
                                           + '\n Average worm positioning time :' 
-                                          + str(numpy.mean(self.time_to_position_worms)))
+                                          + str(numpy.mean(self.time_to_position_worms))
+                                          + '\n Dropped frames :' 
+                                          + str(self.dropped_frames)
+                                          + '\n Stale frames skipped :' 
+                                          + str(self.stale_frames)
+                                          + '\n Polling duty cycle :' 
+                                          + str(self.poll_scheduler.duty_cycle()))
             self.device_stop_run()
+            #The last checkpoint is written once every save has finished
+            self.workers.shutdown(wait=True)
+            self.save_workers.shutdown(wait=True)
+            self.save_checkpoint()
+            self.checkpointer.shutdown(wait=True)
+            self.summary_statistics.write('\n Failed image saves :' 
+                                          + str(self.failed_saves))
             print('fianlly went')
             self.summary_statistics.close()
+            self.worm_data.close()
                 
     def main(self):
         self.device = iotool.IOTool("/dev/ttyMicrofluidics")
@@ -552,10 +1116,9 @@ class NoSort(MicroDevice):
         """
         image1 = self.capture_image(self.bright)
         image2 = self.capture_image(self.bright)
-        subtracted = abs(image1 - image2)
-        self.detect_background = numpy.sum(subtracted[DETECTION_AREA])
-        self.positioned_background = numpy.sum(subtracted[POSITION_AREA])
-        self.clear_background = numpy.sum(subtracted[CLEARING_AREA])
+        self.detect_background = difference_sum(image1, image2, DETECTION_AREA)
+        self.positioned_background = difference_sum(image1, image2, POSITION_AREA)
+        self.clear_background = difference_sum(image1, image2, CLEARING_AREA)
 
     def analyze_worm(self, current_image):
         """
@@ -576,10 +1139,9 @@ class Alternate(MicroDevice):
         image1 = self.capture_image(self.bright)
         time.sleep(PICTURE_DELAY)
         image2 = self.capture_image(self.bright)
-        subtracted = abs(image1.astype('int32') - image2.astype('int32'))
-        self.detect_background = numpy.sum(subtracted[DETECTION_AREA])
-        self.positioned_background = numpy.sum(subtracted[POSITION_AREA])
-        self.clear_background = numpy.sum(subtracted[CLEARING_AREA])
+        self.detect_background = difference_sum(image1, image2, DETECTION_AREA)
+        self.positioned_background = difference_sum(image1, image2, POSITION_AREA)
+        self.clear_background = difference_sum(image1, image2, CLEARING_AREA)
         
     def analyze_worm(self, current_image):
         """
@@ -597,6 +1159,8 @@ class Alternate(MicroDevice):
 class Mir71(MicroDevice):
     """
     """
+    checkpoint_images = MicroDevice.checkpoint_images + ('cyan_background',)
+
     def set_background_areas(self):
         """
         Function that sets the background values for areas of interest in an
@@ -605,10 +1169,9 @@ class Mir71(MicroDevice):
         image1 = self.capture_image(self.bright)
         time.sleep(PICTURE_DELAY)
         image2 = self.capture_image(self.bright)
-        subtracted = abs(image1.astype('int32') - image2.astype('int32'))
-        self.detect_background = numpy.sum(subtracted[DETECTION_AREA])
-        self.positioned_background = numpy.sum(subtracted[POSITION_AREA])
-        self.clear_background = numpy.sum(subtracted[CLEARING_AREA])
+        self.detect_background = difference_sum(image1, image2, DETECTION_AREA)
+        self.positioned_background = difference_sum(image1, image2, POSITION_AREA)
+        self.clear_background = difference_sum(image1, image2, CLEARING_AREA)
         
         self.cyan_background = self.capture_image(self.cyan)
         self.save_image(self.cyan_background, 'cyan_background')
@@ -628,19 +1191,23 @@ class Mir71(MicroDevice):
         min_size = int(input('What is the min size?'))
         self.min_size_threshold = min_size
             
-    def update_thresholds(self, gfp_amount):
-        self.run_fluorescence.append(gfp_amount)
-        self.bottom_mir71_threshold = numpy.percentile(self.run_fluorescence, 10)
-        self.upper_mir71_threshold = numpy.percentile(self.run_fluorescence, 90)
-        
     def find_fluor_amount(self, subtracted_image, worm_mask):
+        if not worm_mask.any():
+            return 0
         gfp_image = subtracted_image[worm_mask]
         gfp_count = numpy.percentile(gfp_image, 95)
         return gfp_count
 
 class Mir71_Sort(Mir71):
     """
+    Sorts the top and bottom 10% of GFP expressing worms up and down. The
+    percentiles are taken over the worms sorted so far, the thresholds given
+    are used until the first worm is sorted.
     """
+    checkpoint_attributes = Mir71.checkpoint_attributes + (
+        'max_size_threshold', 'min_size_threshold', 'upper_mir71_threshold',
+        'bottom_mir71_threshold')
+
     def __init__(self, exp_direct, min_size, max_size, 
         bottom_mir71_threshold, upper_mir71_threshold):
         super().__init__(exp_direct)
@@ -648,14 +1215,46 @@ class Mir71_Sort(Mir71):
         self.min_size_threshold = min_size
         self.upper_mir71_threshold = upper_mir71_threshold
         self.bottom_mir71_threshold = bottom_mir71_threshold
+        self.run_fluorescence = list()
+        self.up_worms = list()
+        self.rules = self.build_rules()
+        self.rules.save(self.file_location.joinpath(RULES_FILE))
+
+    def restore_state(self, state):
+        super().restore_state(state)
+        self.rules = self.build_rules()
+
+    def restore_records(self, records):
+        super().restore_records(records)
+        sorted_worms = [record for record in records
+                        if record['Outcome'] == 'sorted' and record['fluorGFP']]
+        self.run_fluorescence = [float(record['fluorGFP']) for record in sorted_worms]
+        self.up_worms = [float(record['fluorGFP']) for record in sorted_worms
+                         if record['Worm Direction'] == 'up']
+
+    def build_rules(self):
+        """
+        Returns the sorting rules for the size thresholds and the run gfp
+        percentiles, falling back to the given gfp thresholds
+        """
+        rules = [
+            {'direction': 'up',
+             'when': [{'feature': 'gfp', 'op': '>', 'percentile': 90,
+                       'value': self.upper_mir71_threshold}]},
+            {'direction': 'down',
+             'when': [{'feature': 'gfp', 'op': '<', 'percentile': 10,
+                       'value': self.bottom_mir71_threshold}]}]
+        return sort_rules.RuleSet(
+            sort_rules.size_gate(self.max_size_threshold, self.min_size_threshold)
+            + [sort_rules.Rule.from_config(rule) for rule in rules])
         
     def analyze_worm(self, worm_image):
         gfp_fluor_image = self.capture_image(self.cyan)
-        self.save_image(gfp_fluor_image, 'fluor_gfp', True)
-        gfp_subtracted = abs(gfp_fluor_image.astype('int32')
-                             - self.cyan_background.astype('int32'))
-        worm_mask = self.worm_mask(worm_image) 
-        worm_fluor = self.find_fluor_amount(gfp_subtracted, worm_mask)
+        self.save_image_async(gfp_fluor_image, 'fluor_gfp' + str(self.worm_count))
+        worm = self.find_worm(worm_image)
+        gfp_subtracted = abs_difference(gfp_fluor_image[worm.area],
+                                        self.cyan_background[worm.area])
+        worm_fluor = self.find_fluor_amount(gfp_subtracted, worm.mask)
         
         self.summary_statistics.write("Gfp Fluorescence: " 
             + str(worm_fluor))
@@ -663,43 +1262,33 @@ class Mir71_Sort(Mir71):
         print('GFP value = ' + str(worm_fluor))
         
         double_image = self.capture_image(self.bright)
-        worm_size = self.mask_size(self.worm_mask(double_image))
+        worm_size = self.find_worm(double_image).size
         print("Size of worm after imaging :" + str(worm_size))
         
-        if worm_size > self.max_size_threshold or worm_size < self.min_size_threshold:
+        rule = self.rules.match({'size': worm_size, 'gfp': worm_fluor},
+                                {'gfp': self.run_fluorescence})
+        self.worm_record.update({'Worm Size': worm_size, 'fluorGFP': worm_fluor,
+                                 'Rule': 'default' if rule is None else rule.name})
+        if rule is not None and rule.doubled:
+            self.worm_record['Outcome'] = 'doubled'
             print('Detected Double Worm')
-            self.save_image(double_image, 'doubled worm_analyze' + str(self.worm_count))
+            self.save_image_async(double_image, 'doubled worm_analyze' + str(self.worm_count))
             self.summary_statistics.write( '\n doubled worm size of: '+ str(worm_size)) 
             self.device_sort('straight')
             self.worm_direction = 'straight'
             self.summary_statistics.write("Straight\n")
             print('Doubled worms sorted Straight')
-        elif worm_fluor > self.upper_mir71_threshold:
-            self.update_thresholds(worm_fluor)
-            self.up_worms.append(worm_fluor)
-            self.up += 1
-            self.device_sort('up')
-            self.worm_direction = 'up'
-            self.summary_statistics.write("Up\n")
-            print('Worm sorted Up    ' + str(self.up))
-        elif worm_fluor < self.bottom_mir71_threshold:
-            self.update_thresholds(worm_fluor)
-            self.down += 1
-            self.device_sort('down')
-            self.worm_direction = 'down'
-            self.summary_statistics.write("Down\n")
-            print('Worm sorted Down   ' + str(self.down))
         else:
-            self.update_thresholds(worm_fluor)
-            self.straight += 1
-            self.device_sort('straight')
-            self.worm_direction = 'straight'
-            self.summary_statistics.write("straight\n")
-            print('Worm sorted straight    ' + str(self.straight))
+            self.run_fluorescence.append(worm_fluor)
+            if rule is not None and rule.direction == 'up':
+                self.up_worms.append(worm_fluor)
+            self.sort_worm('straight' if rule is None else rule.direction)
 
 class Mir71_SetUp(Mir71):
     """
     """
+    #Calibration runs are short and keep their survey out of the checkpoint
+    resumable = False
     
     def __init__(self, exp_direct):
         super().__init__(exp_direct)
@@ -733,52 +1322,115 @@ class Mir71_SetUp(Mir71):
         print('90_gfp =' + str(self.upper_mir71_threshold))
 
     def analyze_worm(self, current_image):
-        if self.worm_count > (num_of_worms - 1):
+        if len(self.size) > (self.num_of_worms - 1):
             self.quit()
-        worm_mask = self.worm_mask(current_image)
-        worm_size = self.mask_size(worm_mask)
-        if worm_size > max_worm_size or worm_size < min_worm_size:
+        worm = self.find_worm(current_image)
+        worm_size = worm.size
+        self.worm_record['Worm Size'] = worm_size
+        if worm_size > self.max_worm_size or worm_size < self.min_worm_size:
             self.worm_direction = 'straight'
+            self.worm_record['Outcome'] = 'doubled'
         else:
-            self.worm_count += 1
-            print('Worm number ' + str(worm_count) + ' out of ' + str(num_of_worms))
-            self.save_image(current_image, 'calibration_worm'+ str(worm_count))
+            worm_number = len(self.size) + 1
+            print('Worm number ' + str(worm_number) + ' out of ' + str(self.num_of_worms))
+            self.save_image(current_image, 'calibration_worm'+ str(worm_number))
             print('images_saved')
             current_image = self.capture_image(self.cyan)
-            self.save_image(current_image, 'calibration_worm_fluor' + str(worm_count))
-            gfp_image = abs(current_image.astype('int32')- self.cyan_background.astype('int32'))
-            gfp_amount = self.find_fluor_amount(gfp_image, worm_mask)
+            self.save_image(current_image, 'calibration_worm_fluor' + str(worm_number))
+            gfp_image = abs_difference(current_image[worm.area],
+                                       self.cyan_background[worm.area])
+            gfp_amount = self.find_fluor_amount(gfp_image, worm.mask)
             print('GFP amount = ' + str(gfp_amount))
             self.scope.camera.exposure_time = BRIGHT_FIELD_EXPOSURE_TIME
             self.lamp_off()
             self.scope.tl.lamp.enabled = True
             self.size.append(worm_size)
             self.fluorescence.append(gfp_amount)
+            self.worm_record['fluorGFP'] = gfp_amount
             self.device_sort('straight')
             self.worm_direction = 'straight'
 
 class fluorRedGreen(MicroDevice):
     """
+    Sorts worms on their GFP and mCherry fluorescence. Without a rules file the
+    thresholds are asked for and green worms go up, red worms go down.
+    A json rules file (see sort_rules) can be given instead for other screens,
+    the size thresholds are still asked for if it has no doubled rules.
     """
-    def __init__(self, exp_direct):
+    checkpoint_attributes = MicroDevice.checkpoint_attributes + (
+        'gfp_threshold', 'mcherry_threshold', 'size_threshold',
+        'min_size_threshold')
+    checkpoint_images = MicroDevice.checkpoint_images + ('cyan_background', 'green_background')
+
+    def __init__(self, exp_direct, rules_file=None):
         super().__init__(exp_direct)
-        gfp = input('What do you want as the GFP Threshold = ')
-        self.gfp_threshold = int(gfp)
-        mcherry = input('What do you want as the mcherry Threshold = ')
-        self.mcherry_threshold = int(mcherry)
-        size = input('What do you want the Size Threshold = ')
-        self.size_threshold = int(size)
-        min_size = input('What do you want the small size threshold = ')
-        self.min_size_threshold = int(min_size)
+        if rules_file is None:
+            gfp = input('What do you want as the GFP Threshold = ')
+            self.gfp_threshold = int(gfp)
+            mcherry = input('What do you want as the mcherry Threshold = ')
+            self.mcherry_threshold = int(mcherry)
+            size = input('What do you want the Size Threshold = ')
+            self.size_threshold = int(size)
+            min_size = input('What do you want the small size threshold = ')
+            self.min_size_threshold = int(min_size)
+            self.rules = self.build_rules()
+        else:
+            self.rules = sort_rules.RuleSet.load(rules_file)
+            if not self.rules.checks_doubled:
+                print('Rules file does not check for doubled worms')
+                size = input('What do you want the Size Threshold = ')
+                self.size_threshold = int(size)
+                min_size = input('What do you want the small size threshold = ')
+                self.min_size_threshold = int(min_size)
+                self.rules = sort_rules.RuleSet(
+                    sort_rules.size_gate(self.size_threshold, self.min_size_threshold)
+                    + self.rules.rules, self.rules.default)
+        self.rules.save(self.file_location.joinpath(RULES_FILE))
+        self.run_features = {'size': list(), 'gfp': list(), 'mcherry': list()}
+
+    def checkpoint_state(self):
+        state = super().checkpoint_state()
+        state['rules'] = self.rules.to_config()
+        return state
+
+    def restore_state(self, state):
+        super().restore_state(state)
+        self.rules = sort_rules.RuleSet.from_config(state['rules'])
+
+    def restore_records(self, records):
+        super().restore_records(records)
+        analyzed = [record for record in records if record['Rule']]
+        self.run_features = {
+            feature: [float(record[column] or 'nan') for record in analyzed]
+            for feature, column in sort_rules.CSV_COLUMNS.items()}
+
+    def build_rules(self):
+        """
+        Returns the green up/red down rules for the entered thresholds
+        """
+        rules = [
+            {'direction': 'up',
+             'when': [{'feature': 'gfp', 'op': '>', 'value': self.gfp_threshold},
+                      {'feature': 'mcherry', 'op': '<', 'value': self.mcherry_threshold}]},
+            {'direction': 'down',
+             'when': [{'feature': 'gfp', 'op': '<', 'value': self.gfp_threshold},
+                      {'feature': 'mcherry', 'op': '>', 'value': self.mcherry_threshold}]}]
+        return sort_rules.RuleSet(
+            sort_rules.size_gate(self.size_threshold, self.min_size_threshold)
+            + [sort_rules.Rule.from_config(rule) for rule in rules])
         
-    def find_fluor_amount(self, image):
+    def find_fluor_amount(self, image, area=FLUORESCENT_AREA):
         
-        blurred = scipy.ndimage.gaussian_filter(image, sigma = 2)
+        blurred = ndimage.gaussian_filter(image, sigma = 2)
         low_vales = blurred < FLUOR_PIXEL_BRIGHT_VALUE
         blurred[low_vales] = 0
-        scipy.ndimage.morphology.binary_erosion(blurred, None, 4)
-        scipy.ndimage.morphology.binary_dilation(blurred, None, 4)
-        return numpy.sum(blurred[FLUORESCENT_AREA])
+        ndimage.binary_erosion(blurred, None, 4)
+        ndimage.binary_dilation(blurred, None, 4)
+        return numpy.sum(blurred[area], dtype='int64')
+
+    def quantify_channel(self, fluor_image, background):
+        subtracted = abs_difference(fluor_image, background)
+        return self.find_fluor_amount(subtracted)
     
     def set_background_areas(self):
         """
@@ -788,10 +1440,9 @@ class fluorRedGreen(MicroDevice):
         image1 = self.capture_image(self.bright)
         time.sleep(PICTURE_DELAY)
         image2 = self.capture_image(self.bright)
-        subtracted = abs(image1.astype('int32') - image2.astype('int32'))
-        self.detect_background = numpy.sum(subtracted[DETECTION_AREA])
-        self.positioned_background = numpy.sum(subtracted[POSITION_AREA])
-        self.clear_background = numpy.sum(subtracted[CLEARING_AREA])
+        self.detect_background = difference_sum(image1, image2, DETECTION_AREA)
+        self.positioned_background = difference_sum(image1, image2, POSITION_AREA)
+        self.clear_background = difference_sum(image1, image2, CLEARING_AREA)
         
         self.cyan_background = self.capture_image(self.cyan)
         self.save_image(self.cyan_background, 'cyan_background')
@@ -808,68 +1459,100 @@ class fluorRedGreen(MicroDevice):
         function that tells the device what sorting/analzying method to use:
         Is overwritten by a super class
         """
+        #Each channel is quantified and saved on a worker while the next
+        #channel is illuminated and exposed.
         gfp_fluor_image = self.capture_image(self.cyan)
-        gfp_subtracted = abs(gfp_fluor_image.astype('int32')
-                             - self.cyan_background.astype('int32'))
-        color_value_cyan = self.find_fluor_amount(gfp_subtracted)
-        self.save_image(gfp_fluor_image, 'fluor_gfp' + str(self.worm_count))
+        gfp_value = self.workers.submit(self.quantify_channel,
+                                        gfp_fluor_image, self.cyan_background)
+        self.save_image_async(gfp_fluor_image, 'fluor_gfp' + str(self.worm_count))
         
         mcherry_fluor_image = self.capture_image(self.green_yellow)
-        mcherry_subtracted = abs(mcherry_fluor_image.astype('int32')
-                                 - self.green_background.astype('int32'))
-        color_value_green = self.find_fluor_amount(mcherry_subtracted)
-        self.save_image(mcherry_fluor_image, 'fluor_mcherry' + str(self.worm_count))
-
-        print('GFP value = ' + str(color_value_cyan))
-        print('mCherry value = ' + str(color_value_green))
+        mcherry_value = self.workers.submit(self.quantify_channel,
+                                            mcherry_fluor_image, self.green_background)
+        self.save_image_async(mcherry_fluor_image, 'fluor_mcherry' + str(self.worm_count))
         
         double_image = self.capture_image(self.bright)
-        worm_size = self.mask_size(self.worm_mask(double_image))
+        worm_size = self.find_worm(double_image).size
         print("Size of worm after imaging :" + str(worm_size))
+
+        color_value_cyan = gfp_value.result()
+        color_value_green = mcherry_value.result()
+        print('GFP value = ' + str(color_value_cyan))
+        print('mCherry value = ' + str(color_value_green))
         
         self.lamp_off()
         self.scope.tl.lamp.enabled = True
         self.scope.camera.exposure_time = BRIGHT_FIELD_EXPOSURE_TIME
         
+        features = {'size': worm_size, 'gfp': color_value_cyan, 'mcherry': color_value_green}
+        rule = self.rules.match(features, self.run_features)
+        for feature, value in features.items():
+            self.run_features[feature].append(value)
+        self.worm_record.update({'Worm Size': worm_size, 'fluorGFP': color_value_cyan,
+                                 'fluorMcherry': color_value_green,
+                                 'Rule': 'default' if rule is None else rule.name})
+
         self.summary_statistics.write("Gfp Fluorescence: " 
             + str(color_value_cyan) 
-            + "\nGfp Required: " 
-            + str(self.gfp_threshold) 
             + "\nMcherry Fluorescence: " 
             + str(color_value_green) 
-            + "\nMcherry Required :" 
-            + str(self.mcherry_threshold) 
             + "\nSize of Worm after imaging: "
             + str(worm_size) 
+            + "\nSort rule: "
+            + ('default' if rule is None else rule.name)
             + "\n")
 
-        if worm_size > self.size_threshold:
+        if rule is not None and rule.doubled:
+            self.worm_record['Outcome'] = 'doubled'
             print('Detected Double Worm')
-            self.save_image(double_image, 'doubled worm_analyze' + str(self.worm_count))
+            self.save_image_async(double_image, 'doubled worm_analyze' + str(self.worm_count))
             self.summary_statistics.write( '\n doubled worm size of: '+ str(worm_size)) 
             self.device_sort('straight')
             self.worm_direction = 'straight'
             self.summary_statistics.write("Straight\n")
             print('Worm sorted Straight')     
+        else:
+            self.sort_worm(self.rules.default if rule is None else rule.direction)
 
-        elif ((color_value_cyan > self.gfp_threshold) 
-        and (color_value_green < self.mcherry_threshold)):
-            #Worm is determined to be green and not red.
-            self.device_sort('up')
-            self.worm_direction = 'up'
-            self.summary_statistics.write("Up\n")
-            print('Worm sorted Up')
-
-        elif ((color_value_cyan < self.gfp_threshold) 
-        and (color_value_green > self.mcherry_threshold)):
-            #Worm is detremined to be red and not green.
-            self.device_sort('down')
-            self.worm_direction = 'down'
-            self.summary_statistics.write("Down\n")
-            print('Worm sorted Down')
+def load_checkpoint(exp_direct):
+    """
+    Returns the saved sorter state and background frames of an experiment
+    """
+    exp_direct = Path(exp_direct)
+    with open(str(exp_direct.joinpath(CHECKPOINT_FILE))) as state_file:
+        state = json.load(state_file)
+    with numpy.load(str(exp_direct.joinpath(CHECKPOINT_IMAGES_FILE))) as image_file:
+        images = {name: image_file[name] for name in image_file.files}
+    return state, images
 
-        else:
-            self.device_sort('straight')
-            self.worm_direction = 'straight'
-            self.summary_statistics.write("Straight\n")
-            print('Worm sorted Straight')     
+def load_worm_records(exp_direct):
+    """
+    Returns the rows of the wormdata.csv of an experiment as dicts
+    """
+    data_location = Path(exp_direct).joinpath('wormdata.csv')
+    if not data_location.exists():
+        return list()
+    with open(str(data_location), newline='') as wormdata:
+        return list(csv.DictReader(wormdata, dialect='excel'))
+
+def resume(exp_direct):
+    """
+    Rebuilds a sorter from the checkpoint in exp_direct without re-imaging
+    backgrounds or re-entering thresholds. Sorting continues in the same
+    experiment directory once run() is called.
+    """
+    state, images = load_checkpoint(exp_direct)
+    sorter_class = globals().get(state['class'])
+    if not (isinstance(sorter_class, type) and issubclass(sorter_class, MicroDevice)
+            and sorter_class.resumable):
+        raise ValueError(state['class'] + ' sorters cannot be resumed')
+    records = load_worm_records(exp_direct)
+    sorter = sorter_class.__new__(sorter_class)
+    MicroDevice.__init__(sorter, exp_direct, resumed=True)
+    for name, image in images.items():
+        setattr(sorter, name, image.astype('uint16', copy=False))
+    sorter.restore_state(state)
+    sorter.restore_records(records)
+    sorter.summary_statistics.write('\nResumed from checkpoint at worm ' 
+                                    + str(sorter.worm_count) + '\n')
+    return sorter
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Synthetic frames and timing reports shared by the benchmarks (and the tests
+that run their checks).
+
+A frame is a flat background with gaussian noise; worms are drawn into it as
+rectangles darker than the background, fluorescence as brighter ones.
+"""
+
+import numpy
+
+BACKGROUND_LEVEL = 20000
+NOISE = 50
+WORM_CONTRAST = 2000
+
+#A single worm positioned in the boiler, in full size coordinates
+WORM = (slice(300, 450), slice(552, 568))
+
+
+def scale(area, factor):
+    """
+    Returns a full size area in the coordinates of frames binned by factor
+    """
+    return tuple(slice(part.start // factor, part.stop // factor) for part in area)
+
+def frame_maker(size, seed=0):
+    """
+    Returns a function making noisy uint16 frames of size around a level,
+    reproducible for a given seed
+    """
+    random = numpy.random.RandomState(seed)
+    def frame(level=BACKGROUND_LEVEL):
+        return random.normal(level, NOISE, size).astype('uint16')
+    return frame
+
+def draw(image, areas, change=-WORM_CONTRAST, factor=1):
+    """
+    Adds change to the full size areas of image, binned by factor
+    """
+    for area in areas:
+        region = image[scale(area, factor)]
+        region[...] = region.astype('int32') + change
+    return image
+
+def report(name, times, width=28):
+    print('{:<{width}} min {:8.2f} ms   median {:8.2f} ms'.format(
+        name, 1000 * min(times), 1000 * numpy.median(times), width=width))
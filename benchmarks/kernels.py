@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Regression check and micro-benchmark of the per frame analysis kernels.
+
+A small corpus of frames (empty channel, worm in the queue, positioned,
+moving, leaving and doubled worms, with a cyan fluorescence frame each) is
+generated from a fixed seed at the full 1280x1080 size and at a 2x binned
+size. The frames are synthetic (see common.py), no recorded frames of the
+device come with the repository. For every kernel
+
+    check_queue, check_position, check_lost, check_cleared, worm_mask,
+    Mir71.find_fluor_amount, fluorRedGreen.find_fluor_amount
+
+the reference implementation and the optimized one used by the sorter must
+give the expected decision on every frame and agree with each other exactly;
+at full size the sorter methods themselves are checked too. The references
+are the original int32, full frame code; the original worm_mask did not run,
+so its reference is a plain full frame segmentation that removes dust object
+by object. tests/test_kernels.py runs the same checks. Each kernel is then
+timed in ns/frame and the results are appended to a history file so speed
+can be tracked over time.
+The default history file, benchmarks/kernel_history.csv, is local to each
+machine and ignored by git.
+
+usage: python benchmarks/kernels.py [repeats] [history.csv]
+"""
+
+import contextlib
+import csv
+import io
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import numpy
+
+REPO = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO))
+
+import Modular_Sort
+from benchmarks import common
+from benchmarks.common import scale
+
+REPEATS = 10
+HISTORY = REPO.joinpath('benchmarks', 'kernel_history.csv')
+SIZES = {'full': 1, 'binned': 2} #Downscaling of Modular_Sort.IMAGE_SIZE
+
+GFP_LEVEL = 800
+
+#Worms of each scene in full size coordinates: (current frame, previous frame)
+WORM = common.WORM
+SCENES = {
+    'empty channel': ([], []),
+    'worm in queue': ([(slice(1080, 1180), slice(545, 565))],
+                      [(slice(1080, 1180), slice(545, 565))]),
+    'worm positioned': ([WORM], [WORM]),
+    'worm moving': ([WORM], [(slice(120, 270), slice(552, 568))]),
+    'worm leaving': ([(slice(680, 750), slice(552, 568))],
+                     [(slice(680, 750), slice(552, 568))]),
+    'doubled worms': ([WORM, (slice(500, 640), slice(545, 575))],
+                      [WORM, (slice(500, 640), slice(545, 575))]),
+}
+#Expected decisions at full size; worm sizes shrink with the binning
+EXPECTED = {
+    'empty channel':   {'queue': False, 'position': True, 'lost': True, 'cleared': True, 'size': 0},
+    'worm in queue':   {'queue': True, 'position': True, 'lost': True, 'cleared': True, 'size': 0},
+    'worm positioned': {'queue': False, 'position': True, 'lost': False, 'cleared': False, 'size': 2400},
+    'worm moving':     {'queue': False, 'position': False, 'lost': False, 'cleared': False, 'size': 2400},
+    'worm leaving':    {'queue': False, 'position': True, 'lost': False, 'cleared': True, 'size': 1120},
+    'doubled worms':   {'queue': False, 'position': True, 'lost': False, 'cleared': False, 'size': 6600},
+}
+AREAS = ('BOILER_AREA', 'DETECTION_AREA', 'POSITION_AREA', 'CLEARING_AREA',
+         'QUEUE_AREA', 'FLUORESCENT_AREA', 'SEGMENTATION_AREA', 'FULL_FRAME')
+
+
+def pixels(area):
+    return (area[0].stop - area[0].start) * (area[1].stop - area[1].start)
+
+class Corpus:
+    """
+    Frames and analysis constants of one image size
+    """
+    def __init__(self, factor, seed=0):
+        self.size = tuple(side // factor for side in Modular_Sort.IMAGE_SIZE)
+        self.areas = {name: scale(getattr(Modular_Sort, name), factor) for name in AREAS}
+        self.shade = numpy.ones(self.size, dtype=bool)
+        self.shade[self.areas['BOILER_AREA']] = False
+        frame = common.frame_maker(self.size, seed)
+        def draw(image, worms, change):
+            return common.draw(image, worms, change, factor)
+
+        self.background = frame()
+        noise = frame()
+        self.detect_background = Modular_Sort.difference_sum(
+            self.background, noise, self.areas['DETECTION_AREA'])
+        self.positioned_background = Modular_Sort.difference_sum(
+            self.background, noise, self.areas['POSITION_AREA'])
+        self.worm_threshold = (Modular_Sort.WORM_MASK_THRES * self.positioned_background
+                               / pixels(self.areas['POSITION_AREA']))
+        self.cyan_background = frame(common.BACKGROUND_LEVEL // 10)
+
+        self.scenes = list()
+        for name, (worms, previous_worms) in SCENES.items():
+            expected = dict(EXPECTED[name])
+            expected['size'] //= factor ** 2
+            self.scenes.append({'name': name,
+                                'current': draw(frame(), worms, -common.WORM_CONTRAST),
+                                'previous': draw(frame(), previous_worms, -common.WORM_CONTRAST),
+                                'cyan': draw(frame(common.BACKGROUND_LEVEL // 10), worms, GFP_LEVEL),
+                                'expected': expected})
+
+
+#Reference kernels: the original code, widening every frame to int32
+def reference_difference_sum(image1, image2, area):
+    return numpy.sum(abs(image1[area].astype('int32') - image2[area].astype('int32')))
+
+def reference_queue(corpus, scene):
+    return (reference_difference_sum(scene['current'], corpus.background, corpus.areas['QUEUE_AREA'])
+            > Modular_Sort.QUEUE_THREH * corpus.detect_background)
+
+def reference_position(corpus, scene):
+    movement = reference_difference_sum(scene['current'], scene['previous'], corpus.areas['POSITION_AREA'])
+    return (movement - corpus.positioned_background
+            < Modular_Sort.POSITION_THRES * corpus.positioned_background)
+
+def reference_lost(corpus, scene):
+    visibility = reference_difference_sum(scene['current'], corpus.background, corpus.areas['BOILER_AREA'])
+    return (visibility - corpus.positioned_background
+            < Modular_Sort.LOST_CUTOFF * corpus.positioned_background)
+
+def reference_cleared(corpus, scene):
+    visibility = reference_difference_sum(scene['current'], corpus.background, corpus.areas['CLEARING_AREA'])
+    return (visibility - corpus.positioned_background
+            < Modular_Sort.LOST_CUTOFF * corpus.positioned_background)
+
+def reference_worm_mask(corpus, scene):
+    difference = abs(scene['current'].astype('int32') - corpus.background.astype('int32'))
+    mask = difference > corpus.worm_threshold
+    mask[corpus.shade] = False
+    labels, count = Modular_Sort.ndimage.label(mask)
+    for label in range(1, count + 1):
+        worm = labels == label
+        if numpy.count_nonzero(worm) < Modular_Sort.DUST_SIZE:
+            mask[worm] = False
+    return Modular_Sort.ndimage.binary_fill_holes(mask)
+
+def reference_mir71_fluor(corpus, scene):
+    mask = reference_worm_mask(corpus, scene)
+    if not mask.any():
+        return 0
+    subtracted = abs(scene['cyan'].astype('int32') - corpus.cyan_background.astype('int32'))
+    return numpy.percentile(subtracted[mask], 95)
+
+def reference_red_green_fluor(corpus, scene):
+    subtracted = abs(scene['cyan'].astype('int32') - corpus.cyan_background.astype('int32'))
+    blurred = Modular_Sort.ndimage.gaussian_filter(subtracted, sigma = 2)
+    blurred[blurred < Modular_Sort.FLUOR_PIXEL_BRIGHT_VALUE] = 0
+    Modular_Sort.ndimage.binary_erosion(blurred, None, 4)
+    Modular_Sort.ndimage.binary_dilation(blurred, None, 4)
+    return numpy.sum(blurred[corpus.areas['FLUORESCENT_AREA']])
+
+
+#Optimized kernels: the code the sorter runs, with the areas of the corpus
+def optimized_queue(corpus, scene):
+    return (Modular_Sort.difference_sum(scene['current'], corpus.background, corpus.areas['QUEUE_AREA'])
+            > Modular_Sort.QUEUE_THREH * corpus.detect_background)
+
+def optimized_position(corpus, scene):
+    movement = Modular_Sort.difference_sum(scene['current'], scene['previous'], corpus.areas['POSITION_AREA'])
+    return (movement - corpus.positioned_background
+            < Modular_Sort.POSITION_THRES * corpus.positioned_background)
+
+def optimized_lost(corpus, scene):
+    visibility = Modular_Sort.difference_sum(scene['current'], corpus.background, corpus.areas['BOILER_AREA'])
+    return (visibility - corpus.positioned_background
+            < Modular_Sort.LOST_CUTOFF * corpus.positioned_background)
+
+def optimized_cleared(corpus, scene):
+    visibility = Modular_Sort.difference_sum(scene['current'], corpus.background, corpus.areas['CLEARING_AREA'])
+    return (visibility - corpus.positioned_background
+            < Modular_Sort.LOST_CUTOFF * corpus.positioned_background)
+
+def optimized_worm_mask(corpus, scene):
+    worm = Modular_Sort.segment_worm(scene['current'], corpus.background, corpus.worm_threshold,
+                                     corpus.areas['SEGMENTATION_AREA'], corpus.shade)
+    mask = numpy.zeros(corpus.size, dtype=bool)
+    mask[worm.area] = worm.mask
+    return mask
+
+def optimized_mir71_fluor(corpus, scene):
+    worm = Modular_Sort.segment_worm(scene['current'], corpus.background, corpus.worm_threshold,
+                                     corpus.areas['SEGMENTATION_AREA'], corpus.shade)
+    subtracted = Modular_Sort.abs_difference(scene['cyan'][worm.area], corpus.cyan_background[worm.area])
+    return Modular_Sort.Mir71.find_fluor_amount(None, subtracted, worm.mask)
+
+def optimized_red_green_fluor(corpus, scene):
+    subtracted = Modular_Sort.abs_difference(scene['cyan'], corpus.cyan_background)
+    return Modular_Sort.fluorRedGreen.find_fluor_amount(None, subtracted, corpus.areas['FLUORESCENT_AREA'])
+
+#kernel: (reference, optimized, expected decision key)
+KERNELS = {
+    'check_queue': (reference_queue, optimized_queue, 'queue'),
+    'check_position': (reference_position, optimized_position, 'position'),
+    'check_lost': (reference_lost, optimized_lost, 'lost'),
+    'check_cleared': (reference_cleared, optimized_cleared, 'cleared'),
+    'worm_mask': (reference_worm_mask, optimized_worm_mask, 'size'),
+    'Mir71.find_fluor_amount': (reference_mir71_fluor, optimized_mir71_fluor, None),
+    'fluorRedGreen.find_fluor_amount': (reference_red_green_fluor, optimized_red_green_fluor, None),
+}
+
+
+def sorter_decisions(corpus, scene):
+    """
+    Returns the decisions of the sorter methods themselves (full size only)
+    """
+    sorter = Modular_Sort.Mir71.__new__(Modular_Sort.Mir71)
+    sorter.background = corpus.background
+    sorter.detect_background = corpus.detect_background
+    sorter.positioned_background = corpus.positioned_background
+    red_green = Modular_Sort.fluorRedGreen.__new__(Modular_Sort.fluorRedGreen)
+    with contextlib.redirect_stdout(io.StringIO()):
+        return {'check_queue': sorter.check_queue(scene['current']),
+                'check_position': sorter.check_position(scene['current'], scene['previous']),
+                'check_lost': sorter.check_lost(scene['current']),
+                'check_cleared': sorter.check_cleared(scene['current']),
+                'worm_mask': sorter.worm_mask(scene['current']),
+                'fluorRedGreen.find_fluor_amount': red_green.quantify_channel(
+                    scene['cyan'], corpus.cyan_background)}
+
+def same(value1, value2):
+    return numpy.array_equal(numpy.asarray(value1), numpy.asarray(value2))
+
+def check_corpus(size_name, corpus):
+    """
+    Returns a list of failure messages for one corpus
+    """
+    failures = list()
+    for scene in corpus.scenes:
+        methods = sorter_decisions(corpus, scene) if size_name == 'full' else dict()
+        for kernel, (reference, optimized, key) in KERNELS.items():
+            reference_value = reference(corpus, scene)
+            optimized_value = optimized(corpus, scene)
+            problems = list()
+            if not same(reference_value, optimized_value):
+                problems.append('optimized differs from reference')
+            if kernel in methods and not same(methods[kernel], optimized_value):
+                problems.append('sorter method differs from kernel')
+            if key is not None:
+                decision = optimized_value.sum() if key == 'size' else optimized_value
+                if decision != scene['expected'][key]:
+                    problems.append('expected ' + str(scene['expected'][key]) + ' got ' + str(decision))
+            for problem in problems:
+                failures.append(' / '.join((size_name, scene['name'], kernel, problem)))
+    return failures
+
+def time_kernels(corpus, repeats):
+    """
+    Returns {(kernel, variant): ns per frame} for one corpus
+    """
+    timings = dict()
+    for kernel, (reference, optimized, key) in KERNELS.items():
+        for variant, function in (('reference', reference), ('optimized', optimized)):
+            best = numpy.inf
+            for i in range(repeats):
+                start = time.perf_counter_ns()
+                for scene in corpus.scenes:
+                    function(corpus, scene)
+                best = min(best, (time.perf_counter_ns() - start) / len(corpus.scenes))
+            timings[(kernel, variant)] = best
+    return timings
+
+def revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=str(REPO),
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                              universal_newlines=True).stdout.strip()
+    except OSError:
+        return ''
+
+def append_history(path, rows):
+    path = Path(path)
+    new_file = not path.exists()
+    with open(str(path), 'a', newline='') as history:
+        writer = csv.writer(history, dialect='excel')
+        if new_file:
+            writer.writerow(['Date', 'Revision', 'Kernel', 'Size', 'Variant', 'ns/frame'])
+        writer.writerows(rows)
+
+def main(argv):
+    repeats = int(argv[1]) if len(argv) > 1 else REPEATS
+    history = argv[2] if len(argv) > 2 else HISTORY
+    failures = list()
+    rows = list()
+    date = time.strftime('%Y-%m-%d %H:%M:%S')
+    commit = revision()
+    for size_name, factor in SIZES.items():
+        corpus = Corpus(factor)
+        failures += check_corpus(size_name, corpus)
+        timings = time_kernels(corpus, repeats)
+        print('{} ({}x{})'.format(size_name, *corpus.size))
+        for kernel in KERNELS:
+            reference, optimized = timings[(kernel, 'reference')], timings[(kernel, 'optimized')]
+            print('    {:<34} reference {:12.0f} ns   optimized {:12.0f} ns   {:5.1f}x'.format(
+                kernel, reference, optimized, reference / optimized))
+            rows.append([date, commit, kernel, size_name, 'reference', int(reference)])
+            rows.append([date, commit, kernel, size_name, 'optimized', int(optimized)])
+    append_history(history, rows)
+    for failure in failures:
+        print('FAILED: ' + failure)
+    print('{} decision mismatches'.format(len(failures)))
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
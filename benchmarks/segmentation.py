@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Golden images and benchmark for worm segmentation.
+
+Each golden frame is a noisy background with known worm shapes drawn into it
+(plus dust and objects outside the boiler that must be ignored). The boiler
+area segmentation used while sorting is checked against the expected size and
+bounding box, and against segmenting the full frame, which must give exactly
+the same mask. Both versions are then timed. The golden frames are also
+checked by tests/test_segmentation.py.
+
+usage: python benchmarks/segmentation.py [repeats]
+"""
+
+import sys
+import time
+from pathlib import Path
+
+import numpy
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import Modular_Sort
+from benchmarks import common
+
+REPEATS = 20
+
+
+def noise_threshold():
+    """
+    Returns the worm threshold MicroDevice.worm_threshold() gives for frames
+    with NOISE standard deviation
+    """
+    mean_noise = 2 * common.NOISE / numpy.sqrt(numpy.pi) #Mean |a - b| of two noisy frames
+    return Modular_Sort.WORM_MASK_THRES * mean_noise
+
+def golden_frames(seed=0):
+    """
+    Returns a list of (name, background, image, expected size, expected bounding box)
+    """
+    frame = common.frame_maker(Modular_Sort.IMAGE_SIZE, seed)
+    cases = list()
+    def add(name, worm_areas, other_areas=(), holes=()):
+        background = frame()
+        image = common.draw(frame(), tuple(worm_areas) + tuple(other_areas))
+        for hole in holes:
+            image[hole] = frame()[hole]
+        truth = numpy.zeros(Modular_Sort.IMAGE_SIZE, dtype=bool)
+        for area in worm_areas:
+            truth[area] = True
+        truth &= ~Modular_Sort.boiler()
+        size = int(truth.sum())
+        bounding_box = None
+        if size:
+            rows = numpy.flatnonzero(truth.any(axis=1))
+            columns = numpy.flatnonzero(truth.any(axis=0))
+            bounding_box = (slice(rows[0], rows[-1] + 1), slice(columns[0], columns[-1] + 1))
+        cases.append((name, background, image, size, bounding_box))
+
+    worm = common.WORM
+    add('empty', [])
+    add('single worm', [worm])
+    add('worm with hole', [worm], holes=[(slice(320, 340), slice(556, 564))])
+    add('worm and dust', [worm],
+        [(slice(150, 153), slice(540, 543)), (slice(600, 604), slice(575, 579))])
+    add('doubled worms', [worm, (slice(500, 640), slice(545, 575))])
+    add('worm at boiler edge', [(slice(700, 800), slice(540, 560))])
+    add('worm past channel wall', [(slice(200, 350), slice(520, 560))])
+    add('objects outside boiler', [worm],
+        [(slice(900, 1000), slice(540, 580)), (slice(300, 450), slice(600, 640))])
+    return cases
+
+def check_golden(cases, threshold):
+    """
+    Returns the names of golden frames that are not segmented as expected
+    """
+    failures = list()
+    for name, background, image, size, bounding_box in cases:
+        worm = Modular_Sort.segment_worm(image, background, threshold)
+        full = Modular_Sort.segment_worm(image, background, threshold, Modular_Sort.FULL_FRAME)
+        roi_mask = numpy.zeros(Modular_Sort.IMAGE_SIZE, dtype=bool)
+        roi_mask[worm.area] = worm.mask
+        matches = (worm.size == size and worm.bounding_box == bounding_box
+                   and full.size == size and numpy.array_equal(roi_mask, full.mask))
+        print('{:<26} size {:6d} expected {:6d}   {}'.format(
+            name, worm.size, size, 'ok' if matches else 'FAILED'))
+        if not matches:
+            failures.append(name)
+    return failures
+
+def time_segmentation(image, background, threshold, area, repeats=REPEATS):
+    times = list()
+    for i in range(repeats):
+        start = time.perf_counter()
+        Modular_Sort.segment_worm(image, background, threshold, area)
+        times.append(time.perf_counter() - start)
+    return times
+
+def main(argv):
+    repeats = int(argv[1]) if len(argv) > 1 else REPEATS
+    threshold = noise_threshold()
+    cases = golden_frames()
+    failures = check_golden(cases, threshold)
+
+    name, background, image = cases[1][:3]
+    print()
+    for area_name, area in (('boiler area', Modular_Sort.SEGMENTATION_AREA),
+                            ('full frame', Modular_Sort.FULL_FRAME)):
+        common.report(area_name, time_segmentation(image, background, threshold, area, repeats),
+                      width=26)
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark of how long it takes to get a sorter going again after a restart:
+importing the sorter modules in a fresh interpreter, building the ROI masks
+and loading a full size checkpoint with the worm records it is rebuilt from. None of it touches the scope or device.
+
+usage: python benchmarks/startup.py [repeats]
+"""
+
+import csv
+import json
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy
+
+REPO = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO))
+
+import Modular_Sort
+from benchmarks import common
+
+REPEATS = 5
+IMPORT_TIMER = 'import time; t = time.perf_counter(); import {}; print(time.perf_counter() - t)'
+
+
+def time_import(module, repeats=REPEATS):
+    """
+    Returns the import times of module in fresh interpreters, in seconds
+    """
+    times = list()
+    for i in range(repeats):
+        result = subprocess.run([sys.executable, '-c', IMPORT_TIMER.format(module)],
+                                cwd=str(REPO), stdout=subprocess.PIPE, check=True,
+                                universal_newlines=True)
+        times.append(float(result.stdout))
+    return times
+
+def time_masks(repeats=REPEATS):
+    """
+    Returns the time of the first (uncached) and later calls of boiler()
+    """
+    Modular_Sort.boiler.cache_clear()
+    start = time.perf_counter()
+    Modular_Sort.boiler()
+    first = time.perf_counter() - start
+    start = time.perf_counter()
+    for i in range(repeats):
+        Modular_Sort.boiler()
+    return first, (time.perf_counter() - start) / repeats
+
+def time_checkpoint_load(repeats=REPEATS, worms=1000):
+    """
+    Returns the times to load a checkpoint with full size cyan and green
+    backgrounds and the wormdata.csv of a run with worms worms, in seconds
+    """
+    state = {'class': 'fluorRedGreen', 'worm_count': worms}
+    images = {name: numpy.random.randint(0, 2**16, Modular_Sort.IMAGE_SIZE).astype('uint16')
+              for name in ('background', 'cyan_background', 'green_background')}
+    times = list()
+    with tempfile.TemporaryDirectory() as exp_direct:
+        with open(str(Path(exp_direct, Modular_Sort.CHECKPOINT_FILE)), 'w') as state_file:
+            json.dump(state, state_file)
+        numpy.savez(str(Path(exp_direct, Modular_Sort.CHECKPOINT_IMAGES_FILE)), **images)
+        with open(str(Path(exp_direct, 'wormdata.csv')), 'w', newline='') as wormdata:
+            writer = csv.DictWriter(wormdata, Modular_Sort.WORM_DATA_FIELDS, dialect='excel')
+            writer.writeheader()
+            for worm in range(worms):
+                writer.writerow({'Worm Number': worm, 'Worm Size': 1000, 'fluorGFP': worm,
+                                 'fluorMcherry': worm, 'Timestamp': worm,
+                                 'Outcome': 'sorted', 'Rule': 'up'})
+        for i in range(repeats):
+            start = time.perf_counter()
+            Modular_Sort.load_checkpoint(exp_direct)
+            Modular_Sort.load_worm_records(exp_direct)
+            times.append(time.perf_counter() - start)
+    return times
+
+def main(argv):
+    repeats = int(argv[1]) if len(argv) > 1 else REPEATS
+    common.report('import numpy', time_import('numpy', repeats))
+    common.report('import sort_rules', time_import('sort_rules', repeats))
+    common.report('import Modular_Sort', time_import('Modular_Sort', repeats))
+    first, cached = time_masks(repeats)
+    common.report('boiler mask (first)', [first])
+    common.report('boiler mask (cached)', [cached])
+    common.report('load checkpoint', time_checkpoint_load(repeats))
+
+if __name__ == '__main__':
+    main(sys.argv)
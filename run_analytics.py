@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Yield and throughput report of a finished sorting run.
+
+Reads the per worm records (wormdata.csv) of an experiment directory into
+columns and reports worms/hour over the run, lost and doubled rates, the
+detection, positioning and analysis times, the clearing times by direction,
+and the yield of each sorting direction and rule. Everything is computed with
+numpy over whole columns, so runs with hundreds of thousands of worms take
+seconds.
+
+usage: python run_analytics.py /path/to/experiment [bin minutes]
+"""
+
+import csv
+import sys
+from pathlib import Path
+
+import numpy
+
+
+NUMERIC_FIELDS = ('Worm Number', 'Worm Size', 'Detection Time', 'Positioning Time',
+                  'Analysis Time', 'Sort Time', 'fluorMcherry', 'fluorGFP', 'Timestamp',
+                  'Detection Frame Time', 'Positioned Frame Time')
+TIMING_FIELDS = ('Detection Time', 'Positioning Time', 'Analysis Time', 'Sort Time')
+DIRECTIONS = ('up', 'down', 'straight')
+BIN_MINUTES = 10
+
+
+def load_records(path):
+    """
+    Returns the columns of a wormdata.csv file as arrays, numeric columns as
+    floats with nan for missing values. Short rows (a line cut off by a crash)
+    are padded with missing values.
+    """
+    with open(str(path), newline='') as wormdata:
+        reader = csv.reader(wormdata, dialect='excel')
+        header = next(reader)
+        rows = [row if len(row) == len(header) else (row + [''] * len(header))[:len(header)]
+                for row in reader]
+    columns = list(zip(*rows)) if rows else [()] * len(header)
+    records = dict()
+    for field, column in zip(header, columns):
+        if field in NUMERIC_FIELDS:
+            records[field] = numpy.array([value or 'nan' for value in column], dtype=float)
+        else:
+            records[field] = numpy.array(column, dtype=str)
+    return records
+
+def timing_statistics(times):
+    """
+    Returns count, mean, median and 95th percentile of times, ignoring nan
+    """
+    times = times[~numpy.isnan(times)]
+    if times.size == 0:
+        return {'count': 0, 'mean': numpy.nan, 'median': numpy.nan, '95%': numpy.nan}
+    median, upper = numpy.percentile(times, [50, 95])
+    return {'count': times.size, 'mean': numpy.mean(times), 'median': median, '95%': upper}
+
+def counts(values):
+    """
+    Returns {value: (count, fraction)} of an array of labels
+    """
+    labels, label_counts = numpy.unique(values, return_counts=True)
+    total = max(values.size, 1)
+    return {label: (int(count), count / total) for label, count in zip(labels, label_counts)}
+
+def throughput(timestamps, bin_minutes=BIN_MINUTES):
+    """
+    Returns the start of each time bin (hours into the run) and the worms/hour
+    within it
+    """
+    timestamps = timestamps[~numpy.isnan(timestamps)]
+    if timestamps.size == 0:
+        return numpy.empty(0), numpy.empty(0)
+    bin_seconds = 60 * bin_minutes
+    elapsed = timestamps - timestamps.min()
+    edges = numpy.arange(0, elapsed.max() + bin_seconds, bin_seconds)
+    if edges.size < 2:
+        edges = numpy.array([0, bin_seconds])
+    worms, edges = numpy.histogram(elapsed, bins=edges)
+    return edges[:-1] / 3600, worms * 3600 / bin_seconds
+
+def summarize_run(records, bin_minutes=BIN_MINUTES):
+    """
+    Returns a dict of run statistics from the columns of load_records
+    """
+    timestamps = records['Timestamp']
+    worms = timestamps.size
+    outcomes = records.get('Outcome', numpy.full(worms, 'sorted'))
+    directions = records['Worm Direction']
+    duration = numpy.nanmax(timestamps) - numpy.nanmin(timestamps) if worms > 1 else 0
+    sorted_worms = outcomes == 'sorted'
+
+    summary = {'worms': worms,
+               'hours': duration / 3600,
+               'worms_per_hour': worms * 3600 / duration if duration else numpy.nan,
+               'throughput': throughput(timestamps, bin_minutes),
+               'outcomes': counts(outcomes),
+               'timings': {field: timing_statistics(records[field])
+                           for field in TIMING_FIELDS if field in records},
+               'clear_times': {direction: timing_statistics(
+                                   records['Sort Time'][sorted_worms & (directions == direction)])
+                               for direction in DIRECTIONS},
+               'yields': counts(directions[sorted_worms])}
+    if 'Rule' in records:
+        summary['rules'] = counts(records['Rule'][sorted_worms | (outcomes == 'doubled')])
+    return summary
+
+def format_counts(title, label_counts):
+    lines = [title]
+    for label, (count, fraction) in sorted(label_counts.items()):
+        lines.append('    {:<14} {:8d}  {:6.1%}'.format(label or '(none)', count, fraction))
+    return lines
+
+def format_timings(title, statistics):
+    lines = [title + '  (seconds: mean / median / 95%)']
+    for name, stats in statistics.items():
+        lines.append('    {:<16} {:8d}  {:7.3f} {:7.3f} {:7.3f}'.format(
+            name, stats['count'], stats['mean'], stats['median'], stats['95%']))
+    return lines
+
+def format_report(summary):
+    lines = ['Worms: {}   Hours: {:.2f}   Worms/hour: {:.1f}'.format(
+        summary['worms'], summary['hours'], summary['worms_per_hour'])]
+    lines += format_counts('Outcomes', summary['outcomes'])
+    lines += format_counts('Sort yields', summary['yields'])
+    if 'rules' in summary:
+        lines += format_counts('Sort rules', summary['rules'])
+    lines += format_timings('Timings', summary['timings'])
+    lines += format_timings('Clear times by direction', summary['clear_times'])
+    lines.append('Worms/hour over the run')
+    for start, rate in zip(*summary['throughput']):
+        lines.append('    {:6.2f} h  {:8.1f}'.format(start, rate))
+    return '\n'.join(lines)
+
+def main(argv):
+    if len(argv) not in (2, 3):
+        print('usage: ' + argv[0] + ' experiment_directory [bin minutes]')
+        return 1
+    bin_minutes = float(argv[2]) if len(argv) == 3 else BIN_MINUTES
+    records = load_records(Path(argv[1]).joinpath('wormdata.csv'))
+    print(format_report(summarize_run(records, bin_minutes)))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Declarative rules for deciding which way a worm is sorted.
+
+A rule set maps worm features (size, gfp, mcherry and the gfp/mcherry ratio)
+through fixed thresholds or run percentiles to a direction (up, down or
+straight). Rules are checked in order like an if/elif chain: the first rule
+whose conditions all hold decides the direction and worms that match no rule
+go to the default direction. Features can be single values (one worm while
+sorting) or arrays (a whole recorded run), evaluation is one vectorized call
+either way.
+
+Rule sets are stored as json, for example:
+
+    {
+        "default": "straight",
+        "rules": [
+            {"name": "doubled", "direction": "straight", "doubled": true,
+             "when": [{"feature": "size", "op": ">", "value": 3000}]},
+            {"name": "green", "direction": "up",
+             "when": [{"feature": "gfp", "op": ">", "percentile": 90},
+                      {"feature": "mcherry", "op": "<", "value": 200}]}
+        ]
+    }
+
+Rules marked "doubled" catch doubled worms and worms of the wrong size: the
+sorter sends them straight and records them as doubled instead of sorted.
+Doubled rules always send worms straight.
+
+A percentile condition is resolved against a reference distribution of the
+feature (the worms seen so far while sorting, or the whole run when scoring
+offline), ignoring worms without a measurement. Its "value" is used while no
+reference exists yet; without one the condition does not hold.
+
+Scoring a recorded run from the command line:
+
+    python sort_rules.py rules.json /path/to/experiment/wormdata.csv
+"""
+
+import csv
+import json
+import sys
+
+import numpy
+
+
+DIRECTIONS = ('up', 'down', 'straight')
+FEATURES = ('size', 'gfp', 'mcherry', 'ratio')
+OPERATORS = {'>': numpy.greater,
+             '<': numpy.less,
+             '>=': numpy.greater_equal,
+             '<=': numpy.less_equal}
+
+#Columns of wormdata.csv that hold each feature
+CSV_COLUMNS = {'size': 'Worm Size', 'gfp': 'fluorGFP', 'mcherry': 'fluorMcherry'}
+#Outcomes of worms that were imaged and measured, lost and cleared worms were not
+ANALYZED_OUTCOMES = ('sorted', 'doubled')
+
+
+def derive_features(features):
+    """
+    Returns the features as float arrays, adding the gfp/mcherry ratio when
+    both channels are present
+    """
+    features = {name: numpy.asarray(value, dtype=float)
+                for name, value in features.items()}
+    if 'ratio' not in features and 'gfp' in features and 'mcherry' in features:
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            features['ratio'] = features['gfp'] / features['mcherry']
+    return features
+
+
+class Condition:
+    """
+    A single comparison of one feature against a threshold or a percentile
+    """
+
+    def __init__(self, feature, op, value=None, percentile=None):
+        if feature not in FEATURES:
+            raise ValueError('Unknown feature: ' + str(feature))
+        if op not in OPERATORS:
+            raise ValueError('Unknown comparison: ' + str(op))
+        if value is None and percentile is None:
+            raise ValueError('Condition on ' + feature + ' needs a value or a percentile')
+        if percentile is not None and not 0 <= percentile <= 100:
+            raise ValueError('Percentile must be between 0 and 100')
+        self.feature = feature
+        self.op = op
+        self.value = value
+        self.percentile = percentile
+
+    def threshold(self, reference=None):
+        """
+        Returns the threshold of the condition, resolving percentiles against
+        the reference features when they are available
+        """
+        if self.percentile is not None and reference is not None:
+            distribution = reference.get(self.feature)
+            if distribution is not None and numpy.isfinite(distribution).any():
+                return numpy.nanpercentile(distribution, self.percentile)
+        if self.value is None:
+            return numpy.nan
+        return self.value
+
+    def evaluate(self, features, reference=None):
+        return OPERATORS[self.op](features[self.feature], self.threshold(reference))
+
+    def to_config(self):
+        config = {'feature': self.feature, 'op': self.op}
+        if self.value is not None:
+            config['value'] = self.value
+        if self.percentile is not None:
+            config['percentile'] = self.percentile
+        return config
+
+
+class Rule:
+    """
+    Sends worms in direction when all of its conditions hold. A doubled rule
+    marks the worms it matches as doubled.
+    """
+
+    def __init__(self, direction, conditions, name=None, doubled=False):
+        if direction not in DIRECTIONS:
+            raise ValueError('Unknown direction: ' + str(direction))
+        if doubled and direction != 'straight':
+            raise ValueError('Doubled worms can only be sent straight')
+        self.direction = direction
+        self.conditions = list(conditions)
+        self.doubled = doubled
+        if name is None:
+            name = 'doubled' if doubled else direction
+        self.name = name
+
+    @classmethod
+    def from_config(cls, config):
+        conditions = [Condition(**condition) for condition in config.get('when', [])]
+        return cls(config['direction'], conditions, config.get('name'),
+                   config.get('doubled', False))
+
+    def to_config(self):
+        config = {'name': self.name, 'direction': self.direction,
+                  'when': [condition.to_config() for condition in self.conditions]}
+        if self.doubled:
+            config['doubled'] = True
+        return config
+
+    def evaluate(self, features, reference=None):
+        matched = numpy.ones(numpy.broadcast(*features.values()).shape, dtype=bool)
+        for condition in self.conditions:
+            matched &= condition.evaluate(features, reference)
+        return matched
+
+
+class RuleSet:
+    """
+    Ordered list of rules with a default direction for unmatched worms
+    """
+
+    def __init__(self, rules, default='straight'):
+        if default not in DIRECTIONS:
+            raise ValueError('Unknown direction: ' + str(default))
+        self.rules = list(rules)
+        self.default = default
+
+    @classmethod
+    def from_config(cls, config):
+        return cls([Rule.from_config(rule) for rule in config['rules']],
+                   config.get('default', 'straight'))
+
+    @classmethod
+    def load(cls, path):
+        with open(str(path)) as config_file:
+            return cls.from_config(json.load(config_file))
+
+    def to_config(self):
+        return {'default': self.default,
+                'rules': [rule.to_config() for rule in self.rules]}
+
+    def save(self, path):
+        with open(str(path), 'w') as config_file:
+            json.dump(self.to_config(), config_file, indent=4)
+
+    @property
+    def checks_doubled(self):
+        """
+        True when any rule catches doubled worms
+        """
+        return any(rule.doubled for rule in self.rules)
+
+    @property
+    def features(self):
+        """
+        Set of measured features the rules depend on
+        """
+        needed = {condition.feature for rule in self.rules for condition in rule.conditions}
+        if 'ratio' in needed:
+            needed.discard('ratio')
+            needed.update(('gfp', 'mcherry'))
+        return needed
+
+    def evaluate(self, features, reference=None):
+        """
+        Returns the index of the first matching rule for every worm, worms
+        that match no rule get len(self.rules)
+        """
+        features = derive_features(features)
+        if reference is not None:
+            reference = derive_features(reference)
+        shape = numpy.broadcast(*features.values()).shape
+        if not self.rules:
+            return numpy.zeros(shape, dtype=int)
+        matches = [rule.evaluate(features, reference) for rule in self.rules]
+        return numpy.select(matches, numpy.arange(len(self.rules)),
+                            default=len(self.rules)) * numpy.ones(shape, dtype=int)
+
+    def classify(self, features, reference=None):
+        """
+        Returns the sorting direction of every worm
+        """
+        directions = numpy.array([rule.direction for rule in self.rules] + [self.default])
+        return directions[self.evaluate(features, reference)]
+
+    def match(self, features, reference=None):
+        """
+        Returns the rule deciding a single worm, or None if the default applies
+        """
+        index = int(self.evaluate(features, reference))
+        if index == len(self.rules):
+            return None
+        return self.rules[index]
+
+    def yields(self, directions):
+        """
+        Returns the number and fraction of worms sent in each direction
+        """
+        directions = numpy.asarray(directions)
+        total = max(directions.size, 1)
+        return {direction: (int(numpy.count_nonzero(directions == direction)),
+                            numpy.count_nonzero(directions == direction) / total)
+                for direction in DIRECTIONS}
+
+
+def size_gate(max_size, min_size=None):
+    """
+    Returns the doubled rules for worms above max_size or below min_size
+    """
+    gate = [Rule('straight', [Condition('size', '>', max_size)], doubled=True)]
+    if min_size is not None:
+        gate.append(Rule('straight', [Condition('size', '<', min_size)], doubled=True))
+    return gate
+
+
+def load_worm_data(path, analyzed_only=True):
+    """
+    Reads the feature columns of a wormdata.csv file into float arrays.
+    Lost and cleared worms are left out unless analyzed_only is False.
+    """
+    with open(str(path), newline='') as wormdata:
+        rows = list(csv.DictReader(wormdata, dialect='excel'))
+    if analyzed_only and rows and 'Outcome' in rows[0]:
+        rows = [row for row in rows if row['Outcome'] in ANALYZED_OUTCOMES]
+    features = dict()
+    for feature, column in CSV_COLUMNS.items():
+        if rows and column in rows[0]:
+            features[feature] = numpy.array([row[column] or 'nan' for row in rows], dtype=float)
+    return features
+
+
+def score_run(rules, path, reference=None):
+    """
+    Scores a recorded run offline with rules. Only analyzed worms with all of
+    the features the rules need are scored. Percentiles are taken over the
+    whole run unless a reference is given.
+    Returns the direction of each worm and the yield in each direction.
+    """
+    features = load_worm_data(path)
+    missing = rules.features - set(features)
+    if missing:
+        raise ValueError('Run is missing features: ' + ', '.join(sorted(missing)))
+    measured = [numpy.isfinite(features[feature]) for feature in rules.features]
+    if measured:
+        measured = numpy.logical_and.reduce(measured)
+        features = {name: values[measured] for name, values in features.items()}
+    if reference is None:
+        reference = features
+    directions = rules.classify(features, reference)
+    return directions, rules.yields(directions)
+
+
+def main(argv):
+    if len(argv) != 3:
+        print('usage: ' + argv[0] + ' rules.json wormdata.csv')
+        return 1
+    directions, yields = score_run(RuleSet.load(argv[1]), argv[2])
+    print('Worms scored: ' + str(directions.size))
+    for direction, (count, fraction) in yields.items():
+        print(direction + ': ' + str(count) + ' (' + format(fraction, '.1%') + ')')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,52 @@
+import sys
+import types
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import Modular_Sort
+
+
+class Anything:
+    """
+    Stands in for the scope, the microfluidic device and freeimage, accepts
+    any command
+    """
+    def __getattr__(self, name):
+        return Anything()
+
+    def __setattr__(self, name, value):
+        pass
+
+    def __call__(self, *args, **kwargs):
+        return Anything()
+
+
+@pytest.fixture
+def hardware(monkeypatch):
+    """
+    Lets sorters be made without a scope, device or freeimage
+    """
+    monkeypatch.setattr(Modular_Sort, 'scope_client',
+                        types.SimpleNamespace(client_main=lambda: (Anything(), None)))
+    monkeypatch.setattr(Modular_Sort, 'iotool', types.SimpleNamespace(IOTool=lambda path: Anything()))
+    monkeypatch.setattr(Modular_Sort, 'freeimage', Anything())
+
+
+@pytest.fixture
+def closing():
+    """
+    Closes the files and workers of the sorters passed to it after the test
+    """
+    sorters = list()
+    def close_later(sorter):
+        sorters.append(sorter)
+        return sorter
+    yield close_later
+    for sorter in sorters:
+        sorter.summary_statistics.close()
+        sorter.worm_data.close()
+        for workers in (sorter.workers, sorter.save_workers, sorter.checkpointer):
+            workers.shutdown(wait=True)
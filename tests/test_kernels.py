@@ -0,0 +1,9 @@
+import pytest
+
+from benchmarks import kernels
+
+
+@pytest.mark.parametrize('size_name', list(kernels.SIZES))
+def test_kernels_match_reference_and_expected_decisions(size_name):
+    corpus = kernels.Corpus(kernels.SIZES[size_name])
+    assert kernels.check_corpus(size_name, corpus) == []
@@ -0,0 +1,83 @@
+import pytest
+
+import Modular_Sort
+
+
+class Clock:
+    """
+    Stands in for the time module, sleeping only advances the clock
+    """
+    def __init__(self):
+        self.now = 1000.
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(Modular_Sort, 'time', clock)
+    return clock
+
+
+def scheduler():
+    return Modular_Sort.PollScheduler(idle_time=30, min_interval=.1, max_interval=2, factor=2)
+
+
+def test_no_backoff_before_idle_time(clock):
+    polls = scheduler()
+    clock.now += 29
+    polls.miss()
+    assert not polls.backing_off
+    assert polls.interval == 0
+
+
+def test_backoff_grows_to_max_interval(clock):
+    polls = scheduler()
+    clock.now += 31
+    intervals = list()
+    for miss in range(8):
+        polls.miss()
+        intervals.append(polls.interval)
+    assert intervals == pytest.approx([.1, .2, .4, .8, 1.6, 2, 2, 2])
+
+
+def test_hit_snaps_back_to_full_rate(clock):
+    polls = scheduler()
+    clock.now += 31
+    polls.miss()
+    polls.miss()
+    assert polls.backing_off
+    polls.hit()
+    assert not polls.backing_off
+    #The idle time starts over from the hit
+    clock.now += 10
+    polls.miss()
+    assert not polls.backing_off
+
+
+def test_duty_cycle(clock):
+    polls = scheduler()
+    assert polls.duty_cycle() == 1
+    clock.now += 31
+    polls.miss()
+    polls.miss()
+    polls.wait()
+    assert polls.waited == pytest.approx(.2)
+    assert polls.duty_cycle() == pytest.approx(1 - .2 / 31.2)
+
+
+def test_defaults_read_at_call_time(monkeypatch):
+    monkeypatch.setattr(Modular_Sort, 'IDLE_BACKOFF_TIME', 5)
+    monkeypatch.setattr(Modular_Sort, 'MIN_POLL_INTERVAL', .3)
+    monkeypatch.setattr(Modular_Sort, 'MAX_POLL_INTERVAL', 4)
+    monkeypatch.setattr(Modular_Sort, 'POLL_BACKOFF_FACTOR', 3)
+    polls = Modular_Sort.PollScheduler(factor=1.5)
+    assert polls.idle_time == 5
+    assert polls.min_interval == .3
+    assert polls.max_interval == 4
+    assert polls.factor == 1.5
@@ -0,0 +1,57 @@
+import csv
+import json
+
+import numpy
+import pytest
+
+import Modular_Sort
+
+
+def write_experiment(exp_direct, state, records):
+    with open(str(exp_direct.joinpath(Modular_Sort.CHECKPOINT_FILE)), 'w') as state_file:
+        json.dump(state, state_file)
+    background = numpy.zeros((4, 4), dtype='uint16')
+    numpy.savez(str(exp_direct.joinpath(Modular_Sort.CHECKPOINT_IMAGES_FILE)),
+                background=background, cyan_background=background)
+    with open(str(exp_direct.joinpath('wormdata.csv')), 'w', newline='') as wormdata:
+        writer = csv.DictWriter(wormdata, Modular_Sort.WORM_DATA_FIELDS, dialect='excel')
+        writer.writeheader()
+        for number, record in enumerate(records):
+            writer.writerow(dict(record, **{'Worm Number': number}))
+
+
+def mir71_state(worm_count):
+    return {'class': 'Mir71_Sort', 'worm_count': worm_count,
+            'detect_background': 1, 'positioned_background': 1, 'clear_background': 1,
+            'max_size_threshold': 3000, 'min_size_threshold': 500,
+            'upper_mir71_threshold': 100, 'bottom_mir71_threshold': 10}
+
+
+def test_mir71_resumes_with_run_percentiles(hardware, closing, tmp_path):
+    records = [{'Worm Size': 1000, 'fluorGFP': gfp, 'Worm Direction': 'straight',
+                'Timestamp': gfp, 'Outcome': 'sorted'} for gfp in range(20)]
+    records.append({'Timestamp': 20, 'Outcome': 'lost', 'Worm Direction': 'straight'})
+    #The checkpoint was written before the last worms
+    write_experiment(tmp_path, mir71_state(5), records)
+    sorter = closing(Modular_Sort.resume(tmp_path))
+    assert sorter.worm_count == 21
+    assert sorter.run_fluorescence == list(range(20))
+    reference = {'gfp': sorter.run_fluorescence}
+    #An uninterrupted run would gate on the percentiles of these 20 worms,
+    #not on the thresholds given at the start
+    assert sorter.rules.match({'size': 1000, 'gfp': 18}, reference).direction == 'up'
+    assert sorter.rules.match({'size': 1000, 'gfp': 1}, reference).direction == 'down'
+    assert sorter.rules.match({'size': 1000, 'gfp': 10}, reference) is None
+    assert sorter.rules.match({'size': 4000, 'gfp': 10}, reference).doubled
+
+
+def test_calibration_runs_cannot_be_resumed(hardware, tmp_path):
+    write_experiment(tmp_path, {'class': 'Mir71_SetUp', 'worm_count': 3}, [])
+    with pytest.raises(ValueError):
+        Modular_Sort.resume(tmp_path)
+
+
+def test_only_sorters_can_be_resumed(hardware, tmp_path):
+    write_experiment(tmp_path, {'class': 'PollScheduler', 'worm_count': 3}, [])
+    with pytest.raises(ValueError):
+        Modular_Sort.resume(tmp_path)
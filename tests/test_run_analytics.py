@@ -0,0 +1,55 @@
+import csv
+
+import numpy
+import pytest
+
+import Modular_Sort
+import run_analytics
+
+
+def write_worm_data(path, records):
+    with open(str(path), 'w', newline='') as wormdata:
+        writer = csv.DictWriter(wormdata, Modular_Sort.WORM_DATA_FIELDS, dialect='excel')
+        writer.writeheader()
+        for number, record in enumerate(records):
+            writer.writerow(dict(record, **{'Worm Number': number}))
+
+
+def run_records():
+    records = list()
+    for worm in range(12):
+        direction = ('up', 'down', 'straight')[worm % 3]
+        records.append({'Worm Direction': direction, 'Worm Size': 1000,
+                        'Detection Time': 1, 'Positioning Time': .5,
+                        'Analysis Time': .25, 'Sort Time': .1 * (worm % 3 + 1),
+                        'Timestamp': 60 * worm, 'Outcome': 'sorted', 'Rule': direction})
+    records.append({'Worm Direction': 'straight', 'Timestamp': 720, 'Outcome': 'lost'})
+    return records
+
+
+def test_summarize_run(tmp_path):
+    path = tmp_path.joinpath('wormdata.csv')
+    write_worm_data(path, run_records())
+    summary = run_analytics.summarize_run(run_analytics.load_records(path))
+    assert summary['worms'] == 13
+    assert summary['hours'] == pytest.approx(.2)
+    assert summary['worms_per_hour'] == pytest.approx(65)
+    assert summary['outcomes'] == {'lost': (1, 1 / 13), 'sorted': (12, 12 / 13)}
+    assert summary['yields'] == {direction: (4, 1 / 3) for direction in ('up', 'down', 'straight')}
+    assert summary['timings']['Positioning Time']['count'] == 12
+    assert summary['timings']['Positioning Time']['mean'] == pytest.approx(.5)
+    assert summary['clear_times']['down']['mean'] == pytest.approx(.2)
+    assert summary['rules']['up'] == (4, 1 / 3)
+
+
+def test_cut_off_last_line(tmp_path):
+    path = tmp_path.joinpath('wormdata.csv')
+    write_worm_data(path, run_records())
+    with open(str(path), 'a', newline='') as wormdata:
+        wormdata.write('13,1200,up\r\n')
+    records = run_analytics.load_records(path)
+    assert set(records) == set(Modular_Sort.WORM_DATA_FIELDS)
+    assert all(column.size == 14 for column in records.values())
+    assert records['Worm Size'][-1] == 1200
+    assert numpy.isnan(records['Timestamp'][-1])
+    assert run_analytics.summarize_run(records)['worms'] == 14
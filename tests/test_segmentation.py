@@ -0,0 +1,20 @@
+import numpy
+import pytest
+
+import Modular_Sort
+from benchmarks import segmentation
+
+CASES = segmentation.golden_frames()
+
+
+@pytest.mark.parametrize('name, background, image, size, bounding_box', CASES,
+                         ids=[case[0] for case in CASES])
+def test_golden_frame(name, background, image, size, bounding_box):
+    threshold = segmentation.noise_threshold()
+    worm = Modular_Sort.segment_worm(image, background, threshold)
+    assert worm.size == size
+    assert worm.bounding_box == bounding_box
+    full = Modular_Sort.segment_worm(image, background, threshold, Modular_Sort.FULL_FRAME)
+    roi_mask = numpy.zeros(Modular_Sort.IMAGE_SIZE, dtype=bool)
+    roi_mask[worm.area] = worm.mask
+    assert numpy.array_equal(roi_mask, full.mask)
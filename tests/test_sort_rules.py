@@ -0,0 +1,123 @@
+import csv
+
+import numpy
+import pytest
+
+import sort_rules
+
+
+def write_worm_data(path, rows):
+    with open(str(path), 'w', newline='') as wormdata:
+        writer = csv.DictWriter(wormdata, ['Worm Number', 'Worm Size', 'fluorGFP',
+                                           'fluorMcherry', 'Outcome'], dialect='excel')
+        writer.writeheader()
+        for number, row in enumerate(rows):
+            writer.writerow(dict(row, **{'Worm Number': number}))
+
+
+def test_percentile_ignores_unmeasured_worms():
+    condition = sort_rules.Condition('gfp', '>', percentile=50)
+    reference = {'gfp': numpy.array([1, 2, 3, numpy.nan])}
+    assert condition.threshold(reference) == 2
+
+
+def test_score_run_skips_lost_worms(tmp_path):
+    rows = [{'Worm Size': 1000, 'fluorGFP': gfp, 'Outcome': 'sorted'} for gfp in range(10)]
+    rows.append({'Outcome': 'lost'})
+    path = tmp_path.joinpath('wormdata.csv')
+    write_worm_data(path, rows)
+    rules = sort_rules.RuleSet.from_config({'rules': [
+        {'direction': 'up', 'when': [{'feature': 'gfp', 'op': '>', 'percentile': 50}]}]})
+    directions, yields = sort_rules.score_run(rules, path)
+    assert directions.size == 10
+    assert yields['up'] == (5, .5)
+    assert yields['straight'] == (5, .5)
+
+
+def green_red_rules():
+    return sort_rules.RuleSet.from_config({'rules': [
+        {'name': 'doubled', 'direction': 'straight', 'doubled': True,
+         'when': [{'feature': 'size', 'op': '>', 'value': 3000}]},
+        {'name': 'green', 'direction': 'up',
+         'when': [{'feature': 'gfp', 'op': '>', 'value': 100}]},
+        {'name': 'red', 'direction': 'down',
+         'when': [{'feature': 'mcherry', 'op': '>', 'value': 100}]}]})
+
+
+def test_first_matching_rule_decides():
+    rules = green_red_rules()
+    features = {'size': [4000, 1000, 1000, 1000],
+                'gfp': [500, 500, 50, 500],
+                'mcherry': [500, 50, 500, 500]}
+    assert list(rules.evaluate(features)) == [0, 1, 2, 1]
+    assert list(rules.classify(features)) == ['straight', 'up', 'down', 'up']
+
+
+def test_unmatched_worms_get_the_default():
+    rules = green_red_rules()
+    features = {'size': [1000], 'gfp': [50], 'mcherry': [50]}
+    assert list(rules.evaluate(features)) == [len(rules.rules)]
+    assert rules.match({'size': 1000, 'gfp': 50, 'mcherry': 50}) is None
+
+
+def test_doubled_rules_are_explicit():
+    rules = green_red_rules()
+    assert rules.checks_doubled
+    assert rules.match({'size': 4000, 'gfp': 0, 'mcherry': 0}).doubled
+    assert not rules.match({'size': 1000, 'gfp': 500, 'mcherry': 0}).doubled
+    config = rules.to_config()
+    assert config['rules'][0]['doubled'] is True
+    assert sort_rules.RuleSet.from_config(config).rules[0].doubled
+
+    named = sort_rules.RuleSet.from_config({'rules': [
+        {'name': 'doubled', 'direction': 'straight',
+         'when': [{'feature': 'size', 'op': '>', 'value': 3000}]}]})
+    assert not named.checks_doubled
+
+
+def test_size_gate():
+    rules = sort_rules.RuleSet(sort_rules.size_gate(3000, 500))
+    assert list(rules.evaluate({'size': [4000, 200, 1000]})) == [0, 1, 2]
+    assert all(rule.doubled and rule.direction == 'straight' for rule in rules.rules)
+
+
+def test_percentile_against_reference():
+    rules = sort_rules.RuleSet.from_config({'rules': [
+        {'direction': 'up', 'when': [{'feature': 'gfp', 'op': '>', 'percentile': 90}]}]})
+    reference = {'gfp': numpy.arange(101)}
+    assert list(rules.classify({'gfp': [95, 85]}, reference)) == ['up', 'straight']
+    #The run itself is the reference when scoring offline
+    run = {'gfp': numpy.arange(10)}
+    assert list(rules.classify(run, run)) == ['straight'] * 9 + ['up']
+
+
+def test_percentile_falls_back_to_value_without_reference():
+    with_value = sort_rules.RuleSet.from_config({'rules': [
+        {'direction': 'up', 'when': [{'feature': 'gfp', 'op': '>', 'percentile': 90,
+                                      'value': 100}]}]})
+    without_value = sort_rules.RuleSet.from_config({'rules': [
+        {'direction': 'up', 'when': [{'feature': 'gfp', 'op': '>', 'percentile': 90}]}]})
+    empty = {'gfp': numpy.empty(0)}
+    for reference in (None, empty):
+        assert with_value.match({'gfp': 150}, reference).direction == 'up'
+        assert with_value.match({'gfp': 50}, reference) is None
+        assert without_value.match({'gfp': 150}, reference) is None
+
+
+def test_ratio_feature():
+    rules = sort_rules.RuleSet.from_config({'rules': [
+        {'direction': 'up', 'when': [{'feature': 'ratio', 'op': '>', 'value': 2}]}]})
+    assert rules.features == {'gfp', 'mcherry'}
+    features = {'gfp': [300, 100, 100], 'mcherry': [100, 100, 0]}
+    assert list(rules.classify(features)) == ['up', 'straight', 'up']
+
+
+def test_empty_rule_set_uses_default():
+    rules = sort_rules.RuleSet([], default='down')
+    assert list(rules.classify({'gfp': [1, 2]})) == ['down', 'down']
+    assert rules.match({'gfp': 1}) is None
+
+
+def test_doubled_rules_must_go_straight():
+    with pytest.raises(ValueError):
+        sort_rules.Rule('up', [], doubled=True)
@@ -0,0 +1,61 @@
+import types
+
+import Modular_Sort
+
+
+class Camera:
+    """
+    Counts the sequence acquisitions started, and in which trigger mode
+    """
+    timestamp_hz = 1e6
+
+    def __init__(self):
+        self.started = list()
+
+    def start_image_sequence_acquisition(self, frame_count, trigger_mode):
+        self.started.append(trigger_mode)
+
+    def end_image_sequence_acquisition(self):
+        pass
+
+    def send_software_trigger(self):
+        pass
+
+
+def sorter_with_camera(tmp_path):
+    sorter = Modular_Sort.NoSort(tmp_path)
+    sorter.scope = types.SimpleNamespace(camera=Camera())
+    frame = Modular_Sort.Frame(None, 0., 0)
+    sorter.next_frame = lambda: frame
+    sorter.next_fresh_frame = lambda requested: frame
+    sorter.bright = lambda: None
+    sorter.cyan = lambda: None
+    return sorter
+
+
+def test_one_restart_per_worm(hardware, closing, tmp_path):
+    sorter = closing(sorter_with_camera(tmp_path))
+    sorter.start_detection()
+    for worm in range(3):
+        #Detecting and positioning
+        sorter.capture_frame(sorter.bright)
+        sorter.capture_frame(sorter.bright)
+        sorter.end_detection()
+        #Analysis, the doubled worm check and the clear check of the sort
+        sorter.capture_frame(sorter.cyan)
+        sorter.capture_frame(sorter.bright)
+        sorter.capture_frame(sorter.bright)
+        sorter.start_detection()
+    assert sorter.scope.camera.started == ['Internal', 'Software'] * 3 + ['Internal']
+
+
+def test_idle_polls_are_software_triggered(hardware, closing, tmp_path):
+    sorter = closing(sorter_with_camera(tmp_path))
+    sorter.scope.tl = types.SimpleNamespace(lamp=types.SimpleNamespace())
+    sorter.poll_scheduler = types.SimpleNamespace(wait=lambda: None)
+    sorter.start_detection()
+    sorter.idle_wait()
+    sorter.capture_frame(sorter.bright)
+    sorter.end_idle()
+    sorter.capture_frame(sorter.bright)
+    assert sorter.scope.camera.started == ['Internal', 'Software', 'Internal']
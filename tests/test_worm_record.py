@@ -0,0 +1,55 @@
+import csv
+
+import pytest
+
+import Modular_Sort
+
+
+def read_worm_data(sorter):
+    sorter.worm_data.flush()
+    with open(str(sorter.data_location), newline='') as wormdata:
+        return list(csv.DictReader(wormdata, dialect='excel'))
+
+
+def test_write_worm_record(hardware, closing, tmp_path):
+    sorter = closing(Modular_Sort.NoSort(tmp_path))
+    sorter.time_between_worms = list()
+    sorter.time_to_position_worms = list()
+
+    sorter.time_queue_push_start = 100.
+    sorter.start_worm_record()
+    sorter.time_seen = 101.
+    sorter.time_positioned = 101.5
+    sorter.time_sort_start = 102.
+    sorter.time_sort_end = 102.25
+    sorter.worm_direction = 'up'
+    sorter.worm_record['Worm Size'] = 1000
+    sorter.write_worm_record()
+
+    #A worm that was lost before it was positioned
+    sorter.time_queue_push_start = 110.
+    sorter.start_worm_record()
+    sorter.time_seen = 110.5
+    sorter.worm_direction = 'straight'
+    sorter.worm_record['Outcome'] = 'lost'
+    sorter.write_worm_record()
+
+    first, lost = read_worm_data(sorter)
+    assert first['Worm Number'] == '0'
+    assert first['Worm Direction'] == 'up'
+    assert first['Worm Size'] == '1000'
+    assert first['Outcome'] == 'sorted'
+    assert float(first['Timestamp']) == 100
+    assert float(first['Detection Time']) == pytest.approx(1)
+    assert float(first['Positioning Time']) == pytest.approx(.5)
+    assert float(first['Analysis Time']) == pytest.approx(.5)
+    assert float(first['Sort Time']) == pytest.approx(.25)
+
+    assert lost['Worm Number'] == '1'
+    assert lost['Outcome'] == 'lost'
+    assert float(lost['Detection Time']) == pytest.approx(.5)
+    assert lost['Positioning Time'] == lost['Analysis Time'] == lost['Sort Time'] == ''
+
+    assert sorter.worm_count == 2
+    assert sorter.time_between_worms == [10]
+    assert sorter.time_to_position_worms == [.5]